@@ -0,0 +1,131 @@
+import datetime
+
+# Reports over the whole price history. The visible prices are read into
+# NumPy columns once and read again only when the database has changed, as
+# told by Database.get_data_version; the group-by operations then run over
+# whole columns. NumPy is slow to import, so it is only imported the first
+# time a report needs it.
+
+numpy = None
+
+COLUMNS_SQL = """SELECT pri.id, pri.day, pri.unit_price, pri.store_id, pri.package_id, pac.product_id
+                 FROM (((prices pri JOIN packages pac ON pri.package_id = pac.id)
+                                    JOIN products pro ON pac.product_id = pro.id)
+                                    JOIN brands bra ON pac.brand_id = bra.id)
+                                    JOIN stores sto ON pri.store_id = sto.id
+                 WHERE pri.hide = 0 AND pac.hide = 0 AND pro.hide = 0 AND bra.hide = 0 AND sto.hide = 0
+                 AND pri.unit_price IS NOT NULL"""
+
+EPOCH_DAY = datetime.date(1970, 1, 1).toordinal()
+
+def import_numpy():
+    # Whether NumPy is available.
+    global numpy
+    if numpy == None:
+        try:
+            import numpy as module
+        except ImportError:
+            return False
+        numpy = module
+    return True
+
+def months(days):
+    # Months since year 0 (year * 12 + month - 1) of an array of day numbers.
+    dates = (days - EPOCH_DAY).astype('datetime64[D]')
+    return dates.astype('datetime64[M]').astype(numpy.int64) + 1970 * 12
+
+def month_name(month):
+    return "%04d-%02d" % (month // 12, month % 12 + 1)
+
+def group_percentiles(keys, values, percentiles = (50,)):
+    # Groups values by the tuple of key arrays, the first one being the
+    # primary key, and returns the key arrays of the groups in order, along
+    # with their counts, minimums and the asked percentiles (interpolated
+    # linearly, as numpy.percentile does).
+    count = len(values)
+    if count == 0:
+        empty = numpy.zeros(0)
+        return tuple([key[:0] for key in keys]), empty.astype(numpy.int64), empty, [empty for q in percentiles]
+    order = numpy.lexsort((values,) + tuple(reversed(keys)))
+    keys = [key[order] for key in keys]
+    values = values[order]
+    change = numpy.zeros(count, dtype = bool)
+    change[0] = True
+    for key in keys:
+        change[1:] |= key[1:] != key[:-1]
+    starts = numpy.flatnonzero(change)
+    counts = numpy.diff(numpy.append(starts, count))
+    result = []
+    for q in percentiles:
+        position = starts + (counts - 1) * (q / 100.0)
+        low = numpy.floor(position).astype(numpy.int64)
+        high = numpy.ceil(position).astype(numpy.int64)
+        result.append(values[low] + (values[high] - values[low]) * (position - low))
+    return tuple([key[starts] for key in keys]), counts, values[starts], result
+
+class Analytics:
+
+    def __init__(self, db):
+        self.db = db
+        self.version = None
+
+    def load(self):
+        import_numpy()
+        version = self.db.get_data_version()
+        if version == self.version:
+            return
+        rows = self.db.cursor.execute(COLUMNS_SQL).fetchall()
+        data = numpy.array(rows, dtype = numpy.float64).reshape((len(rows), 6))
+        self.ids         = data[:, 0].astype(numpy.int64)
+        self.days        = data[:, 1].astype(numpy.int64)
+        self.unit_prices = data[:, 2]
+        self.store_ids   = data[:, 3].astype(numpy.int64)
+        self.package_ids = data[:, 4].astype(numpy.int64)
+        self.product_ids = data[:, 5].astype(numpy.int64)
+        self.months      = months(self.days)
+        self.version = version
+
+    def select(self, since_day = None, product_ids = None):
+        self.load()
+        mask = numpy.ones(len(self.ids), dtype = bool)
+        if since_day != None:
+            mask &= self.days >= since_day
+        if product_ids != None:
+            mask &= numpy.isin(self.product_ids, numpy.array(list(product_ids), dtype = numpy.int64))
+        return mask
+
+    def product_summary(self, since_day = None, product_ids = None, percentiles = (25, 50, 75)):
+        # [(product_id, count, minimum, [percentiles])] of the unit price.
+        mask = self.select(since_day, product_ids)
+        keys, counts, minimums, result = group_percentiles((self.product_ids[mask],), self.unit_prices[mask], percentiles)
+        return [(int(keys[0][i]), int(counts[i]), float(minimums[i]), [float(values[i]) for values in result]) for i in range(len(counts))]
+
+    def relative_prices(self, key, mask):
+        # The median unit price of each product within each group of key,
+        # over the product's median in the whole selection.
+        products = self.product_ids[mask]
+        values = self.unit_prices[mask]
+        product_keys, counts, minimums, (medians,) = group_percentiles((products,), values)
+        (group_products, groups), counts, minimums, (group_medians,) = group_percentiles((products, key[mask]), values)
+        overall = medians[numpy.searchsorted(product_keys[0], group_products)]
+        valid = overall > 0
+        return group_products[valid], groups[valid], group_medians[valid] / overall[valid]
+
+    def index_by(self, key, mask, minimum_groups):
+        # Median relative price per group: 100 is what the products usually
+        # cost, taking only the products found in minimum_groups groups.
+        products, groups, ratios = self.relative_prices(key, mask)
+        product_keys, spread = numpy.unique(products, return_counts = True)
+        wide = spread[numpy.searchsorted(product_keys, products)] >= minimum_groups
+        (keys,), counts, minimums, (medians,) = group_percentiles((groups[wide],), ratios[wide])
+        return [(int(keys[i]), int(counts[i]), float(medians[i]) * 100) for i in range(len(counts))]
+
+    def store_index(self, since_day = None, product_ids = None):
+        # [(store_id, product count, index)]
+        mask = self.select(since_day, product_ids)
+        return self.index_by(self.store_ids, mask, 2)
+
+    def month_index(self, since_day = None, product_ids = None):
+        # [(month, product count, index)], with months as in months().
+        mask = self.select(since_day, product_ids)
+        return self.index_by(self.months, mask, 2)
@@ -0,0 +1,409 @@
+import argparse
+import bisect
+import datetime
+import json
+import math
+import os
+import random
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+import layout
+import model
+import search
+
+# Benchmarks hieroch on a generated database: every CLI command is driven
+# through the BATCH stdin path in a fresh process, and the model.Database
+# methods behind them are timed in-process. Latency percentiles and peak
+# memory go to a JSON file that --compare can check against a previous run.
+# The layout benchmark formats price lines the way print_price_summary does,
+# once as cio did before the layout module and once through it. The fuzzy
+# benchmark looks mistyped names up in a trigram index of a large catalog.
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+SIZES = {
+    'small':  {'prices':    1000, 'packages':  1000, 'stores': 10},
+    'medium': {'prices':  100000, 'packages': 10000, 'stores': 50},
+    'large':  {'prices': 1000000, 'packages': 10000, 'stores': 50},
+}
+
+WORDS = ["arroz", "feijao", "acucar", "cafe", "leite", "oleo", "farinha", "sal",
+         "macarrao", "molho", "sabao", "detergente", "papel", "biscoito", "suco",
+         "queijo", "manteiga", "iogurte", "cerveja", "agua", "tomate", "batata",
+         "cebola", "alho", "carne", "frango", "peixe", "ovos", "pao", "chocolate"]
+
+EXTRAS = ["", "", "", "integral", "light", "tipo 1", "zero", "premium", "refil", "extra"]
+
+LAYOUT_WORDS = WORDS + [u"a\u00e7\u00facar", u"feij\u00e3o", u"caf\u00e9", u"p\u00e3o", u"\u00f3leo",
+                        u"\u7c73", u"\u62b9\u8336", u"\u3057\u3087\u3046\u3086", u"\u304a\u8336\u6f2c\u3051"]
+
+def make_barcode(rng):
+    code = "789" + "".join([rng.choice("0123456789") for i in range(9)])
+    return code + model.check_digit(code)
+
+def generate(path, prices, packages, stores, seed = 0):
+    # Package popularity follows a Pareto distribution, prices drift with
+    # 6% yearly inflation plus noise, and a few stores get most visits.
+    rng = random.Random(seed)
+    connection = sqlite3.connect(path)
+    connection.executescript(open(os.path.join(HERE, 'database.sql')).read())
+    connection.commit()
+    connection.close()
+    db = model.Database(path)
+
+    store_ids = [db.insert_store("Store %d" % i)['id'] for i in range(stores)]
+    brand_ids = [0] + [db.insert_brand("Brand %d" % i)['id'] for i in range(max(1, packages // 50))]
+
+    product_count = max(1, packages // 3)
+    products = []
+    for i in range(product_count):
+        name = "%s %d" % (rng.choice(WORDS), i)
+        unit_no = rng.choice([1, 2, 2, 3, 4, 4, 5])
+        products.append(db.insert_product(name, rng.choice(EXTRAS), unit_no))
+
+    barcodes = set()
+    package_rows = []
+    for i in range(packages):
+        product = products[i % product_count]
+        amount = rng.choice([1, 2, 5, 200, 500, 1000])
+        barcode = make_barcode(rng)
+        while barcode in barcodes:
+            barcode = make_barcode(rng)
+        barcodes.add(barcode)
+        package = db.insert_package(product['id'], rng.choice(brand_ids), "v%d" % i, amount, barcode)
+        package_rows.append((package, 50 + rng.paretovariate(1.5) * 200))
+
+    weights = [rng.paretovariate(1.2) for package in package_rows]
+    total = sum(weights)
+    cumulative = []
+    acc = 0.0
+    for weight in weights:
+        acc += weight / total
+        cumulative.append(acc)
+    store_weights = [1.0 / (i + 1) for i in range(stores)]
+    store_total = sum(store_weights)
+
+    start = datetime.date.today() - datetime.timedelta(5 * 365)
+    rows = []
+    for i in range(prices):
+        day = i * 5 * 365 // max(1, prices)
+        index = min(bisect.bisect_left(cumulative, rng.random()), len(package_rows) - 1)
+        package, base = package_rows[index]
+        x = rng.random() * store_total
+        store_index = 0
+        while x > store_weights[store_index] and store_index < stores - 1:
+            x -= store_weights[store_index]
+            store_index += 1
+        price = int(base * math.pow(1.06, day / 365.0) * rng.lognormvariate(0, 0.1))
+        rows.append((store_ids[store_index], package['id'], max(1, price), start + datetime.timedelta(day), 1))
+        if len(rows) == 10000:
+            db.insert_prices(rows)
+            rows = []
+    db.insert_prices(rows)
+    db.save()
+
+def percentiles(samples):
+    samples = sorted(samples)
+    def rank(p):
+        return samples[min(len(samples) - 1, int(math.ceil(p * len(samples))) - 1)]
+    return {'count': len(samples),
+            'mean':  sum(samples) / len(samples),
+            'p50':   rank(0.50),
+            'p90':   rank(0.90),
+            'p99':   rank(0.99),
+            'max':   samples[-1]}
+
+def run_cli(directory, script):
+    # Returns wall time in seconds and peak RSS in kB of one batch process.
+    # DEBUG lets a failing command end the process with a traceback, so a
+    # broken command can't pass for a fast one.
+    env = dict(os.environ)
+    env['BATCH'] = '1'
+    env['DEBUG'] = '1'
+    devnull = open(os.devnull, 'w')
+    errors = tempfile.TemporaryFile()
+    start = time.time()
+    process = subprocess.Popen([sys.executable, os.path.join(HERE, 'hieroch.py')],
+                               cwd = directory, env = env,
+                               stdin = subprocess.PIPE, stdout = devnull, stderr = errors)
+    process.stdin.write(script.encode('utf-8'))
+    process.stdin.close()
+    pid, status, usage = os.wait4(process.pid, 0)
+    elapsed = time.time() - start
+    process.returncode = status
+    devnull.close()
+    if not os.WIFEXITED(status) or os.WEXITSTATUS(status) != 0:
+        errors.seek(0)
+        raise RuntimeError("hieroch failed (status %d) on %r:\n%s" % (status, script, errors.read().decode('utf-8', 'replace')))
+    errors.close()
+    return elapsed, usage.ru_maxrss
+
+def cli_scripts(db, rng):
+    store = db.generic_select('stores', model.Store, suffix = "ORDER BY id LIMIT 1", first = True)
+    popular = db.cursor.execute("""SELECT pac.barcode, pro.name
+                                   FROM (prices pri JOIN packages pac ON pri.package_id = pac.id)
+                                                    JOIN products pro ON pac.product_id = pro.id
+                                   GROUP BY pac.id ORDER BY COUNT(*) DESC LIMIT 20""").fetchall()
+    prefix = "s\n%s\n" % (store['name'],)
+    def pick():
+        return rng.choice(popular)
+    return prefix, [
+        ('p',          lambda: "p\n%s\n%d.%02d\n" % (pick()[0], rng.randint(1, 30), rng.randint(0, 99))),
+        ('w',          lambda: "w\n%s\n" % (pick()[0],)),
+        ('x',          lambda: "x\n%s\n\n\n\n\n\n" % (pick()[1].split()[0],)),
+        ('check',      lambda: "check\n"),
+        ('check full', lambda: "check full\n"),
+        ('dc',         lambda: "dc\n1\n"),
+    ]
+
+def bench_cli(directory, db, repeat, rng):
+    results = {}
+    prefix, scripts = cli_scripts(db, rng)
+    baseline = [run_cli(directory, prefix + "q\n")[0] for i in range(repeat)]
+    startup = percentiles(baseline)['p50']
+    results['cli.startup'] = percentiles(baseline)
+    for name, script in scripts:
+        samples = []
+        peak = 0
+        for i in range(repeat):
+            elapsed, rss = run_cli(directory, prefix + script() + "q\n")
+            samples.append(max(0.0, elapsed - startup))
+            peak = max(peak, rss)
+        results['cli.' + name] = percentiles(samples)
+        results['cli.' + name]['peak_rss_kb'] = peak
+        print("%-24s p50 %8.1f ms  p90 %8.1f ms  rss %7d kB" % ('cli.' + name, results['cli.' + name]['p50'] * 1000, results['cli.' + name]['p90'] * 1000, peak))
+    return results
+
+def model_benchmarks(db, rng):
+    packages = db.cursor.execute("SELECT id, product_id FROM packages ORDER BY RANDOM() LIMIT 50").fetchall()
+    names = [row[0] for row in db.cursor.execute("SELECT name FROM products ORDER BY RANDOM() LIMIT 50").fetchall()]
+    return [
+        ('search_packages',         lambda: db.search_packages(rng.choice(names).split()[0])),
+        ('fuzzy_search_packages',   lambda: db.fuzzy_search_packages(rng.choice(names)[:-1] + "x")),
+        ('get_prices_by_package',   lambda: db.get_prices_by_package(rng.choice(packages)[0])),
+        ('get_prices_with_filter',  lambda: db.get_prices_with_filter([{'field': 'product_id', 'match': 'exact', 'value': rng.choice(packages)[1]}])),
+        ('iter_prices_with_filter', lambda: sum(1 for row in db.iter_prices_with_filter([{'field': 'product_name', 'match': 'fuzzy', 'value': rng.choice(names).split()[0]}], reverse = True))),
+        ('get_packages_by_ids',     lambda: db.get_packages_by_ids([row[0] for row in packages])),
+        ('get_similar_adjacent_prices', lambda: db.get_similar_adjacent_prices()),
+    ]
+
+def bench_model(path, repeat, rng):
+    try:
+        import tracemalloc
+    except ImportError:
+        tracemalloc = None
+    results = {}
+    db = model.Database(path)
+    for name, function in model_benchmarks(db, rng):
+        samples = []
+        peak = None
+        for i in range(repeat):
+            if tracemalloc != None:
+                tracemalloc.start()
+            start = time.time()
+            function()
+            samples.append(time.time() - start)
+            if tracemalloc != None:
+                peak = max(peak or 0, tracemalloc.get_traced_memory()[1])
+                tracemalloc.stop()
+        results['model.' + name] = percentiles(samples)
+        results['model.' + name]['peak_bytes'] = peak
+        print("%-36s p50 %8.2f ms  p90 %8.2f ms" % ('model.' + name, results['model.' + name]['p50'] * 1000, results['model.' + name]['p90'] * 1000))
+    db.db.rollback()
+    return results
+
+def layout_lines(count, rng):
+    # (prefix, spec) pairs shaped like format_price's, as native strings.
+    lines = []
+    for i in range(count):
+        prefix = u"++ %8s %3dd %-3s " % ("%.2f" % (rng.random() * 100), rng.randint(0, 999), rng.choice(WORDS)[:3])
+        spec = u" ".join([rng.choice(LAYOUT_WORDS) for j in range(rng.randint(4, 24))])
+        if sys.version_info[0] < 3:
+            prefix, spec = prefix.encode('utf-8'), spec.encode('utf-8')
+        lines.append((prefix, spec))
+    return lines
+
+# How cio measured and broke UTF-8 text before the layout module.
+
+def utf8_len(s):
+    result = 0
+    for i in range(len(s)):
+        if ord(s[i]) & 0xc0 != 0x80:
+            result += 1
+    return result
+
+def utf8_break(s, n):
+    result = ""
+    more   = ""
+    rest   = ""
+    for i in range(len(s)):
+        if ord(s[i]) & 0xc0 != 0x80:
+            if   n == 0:
+                rest = more + s[i:]
+                break
+            elif s[i] == " ":
+                if result != "":
+                    result += " "
+                result += more
+                more = ""
+            else:
+                more += s[i]
+            n -= 1
+        else:
+            more += s[i]
+    if result == "":
+        result = more
+        rest = ""
+    return result, rest
+
+def layout_old(lines):
+    # Asks the terminal for its size on every line, as cio.columns() did.
+    for s, spec in lines:
+        cols = layout.query_dimensions()[0]
+        len_s = utf8_len(s)
+        if (len_s >= cols) or (len_s + utf8_len(spec) <= cols):
+            s += spec
+        else:
+            first = True
+            while utf8_len(spec) > 0:
+                if not first:
+                    s += "\n" + (" " * len_s)
+                first = False
+                trunc, spec = utf8_break(spec, cols - len_s)
+                s += trunc
+
+def layout_new(lines):
+    for s, spec in lines:
+        cols = layout.dimensions()[0]
+        len_s = layout.width(s)
+        if (len_s >= cols) or (len_s + layout.width(spec) <= cols):
+            s += spec
+        else:
+            s += ("\n" + " " * len_s).join(layout.wrap(spec, cols - len_s))
+
+def bench_layout(count, repeat, rng):
+    results = {}
+    lines = layout_lines(count, rng)
+    for name, function in [('old', layout_old), ('new', layout_new)]:
+        samples = []
+        for i in range(repeat):
+            layout.forget_dimensions()
+            start = time.time()
+            function(lines)
+            samples.append(time.time() - start)
+        results['layout.' + name] = percentiles(samples)
+        print("%-36s p50 %8.1f ms  p90 %8.1f ms  (%d lines)" % ('layout.' + name, results['layout.' + name]['p50'] * 1000, results['layout.' + name]['p90'] * 1000, count))
+    return results
+
+def fuzzy_entries(count, rng):
+    # Texts shaped like the packages index: name, extras and brand.
+    return [(i, "%s %d %s v%d Brand %d" % (rng.choice(WORDS), i, rng.choice(EXTRAS), i, rng.randint(1, max(1, count // 50))))
+            for i in range(count)]
+
+def mistype(word, rng):
+    i = rng.randrange(len(word))
+    kind = rng.randrange(3)
+    if kind == 0:
+        return word[:i] + word[i + 1:]
+    elif kind == 1:
+        return word[:i] + rng.choice("abcdefghijklmnopqrstuvwxyz") + word[i + 1:]
+    return word[:i] + word[i:i + 2][::-1] + word[i + 2:]
+
+def bench_fuzzy(count, repeat, rng):
+    index = search.TrigramIndex()
+    start = time.time()
+    index.add_all(fuzzy_entries(count, rng))
+    build = time.time() - start
+    patterns = ["aroz", "chocolat", "feijao integral"]
+    for i in range(20):
+        pattern = mistype(rng.choice(WORDS), rng)
+        if rng.random() < 0.5:
+            pattern += " " + rng.choice([extra for extra in EXTRAS if extra != ""])
+        patterns.append(pattern)
+    samples = []
+    for i in range(repeat):
+        for pattern in patterns:
+            start = time.time()
+            index.search(pattern)
+            samples.append(time.time() - start)
+    results = {'fuzzy.search': percentiles(samples)}
+    results['fuzzy.search']['build_seconds'] = build
+    print("%-36s p50 %8.2f ms  p90 %8.2f ms  (%d entries, built in %.1fs)" % ('fuzzy.search', results['fuzzy.search']['p50'] * 1000, results['fuzzy.search']['p90'] * 1000, count, build))
+    return results
+
+def compare(results, previous):
+    print("")
+    print("%-36s %10s %10s %8s" % ("benchmark", "before", "after", "ratio"))
+    for name in sorted(results):
+        if name in previous:
+            before = previous[name]['p50']
+            after = results[name]['p50']
+            ratio = after / before if before > 0 else float('inf')
+            print("%-36s %8.2fms %8.2fms %7.2fx" % (name, before * 1000, after * 1000, ratio))
+
+def main():
+    parser = argparse.ArgumentParser(description = "Benchmark hieroch on a generated database.")
+    parser.add_argument('--size', choices = sorted(SIZES), default = 'small')
+    parser.add_argument('--prices', type = int)
+    parser.add_argument('--packages', type = int)
+    parser.add_argument('--stores', type = int)
+    parser.add_argument('--repeat', type = int, default = 10)
+    parser.add_argument('--seed', type = int, default = 0)
+    parser.add_argument('--database', help = "reuse (or keep) the generated database at this path")
+    parser.add_argument('--skip-cli', action = 'store_true')
+    parser.add_argument('--layout-lines', type = int, default = 100000, help = "price lines to lay out (0 to skip)")
+    parser.add_argument('--layout-repeat', type = int, default = 3)
+    parser.add_argument('--fuzzy-entries', type = int, default = 50000, help = "catalog entries for the fuzzy search benchmark (0 to skip)")
+    parser.add_argument('--output', default = 'bench_results.json')
+    parser.add_argument('--compare', help = "results file of a previous run")
+    args = parser.parse_args()
+
+    size = dict(SIZES[args.size])
+    for key in ['prices', 'packages', 'stores']:
+        if getattr(args, key) != None:
+            size[key] = getattr(args, key)
+
+    directory = tempfile.mkdtemp(prefix = 'hieroch-bench-')
+    try:
+        path = os.path.join(directory, 'hieroch.db')
+        if args.database != None and os.path.exists(args.database):
+            shutil.copy(args.database, path)
+        else:
+            start = time.time()
+            generate(path, size['prices'], size['packages'], size['stores'], args.seed)
+            print("Generated %(prices)d prices, %(packages)d packages, %(stores)d stores" % size + " in %.1fs." % (time.time() - start))
+            if args.database != None:
+                shutil.copy(path, args.database)
+
+        rng = random.Random(args.seed)
+        results = bench_model(path, args.repeat, rng)
+        if not args.skip_cli:
+            db = model.Database(path)
+            results.update(bench_cli(directory, db, args.repeat, rng))
+            db.db.close()
+        if args.layout_lines > 0:
+            results.update(bench_layout(args.layout_lines, args.layout_repeat, rng))
+        if args.fuzzy_entries > 0:
+            results.update(bench_fuzzy(args.fuzzy_entries, args.repeat, rng))
+    finally:
+        shutil.rmtree(directory)
+
+    output = {'meta': {'size': size,
+                       'repeat': args.repeat,
+                       'python': sys.version.split()[0],
+                       'sqlite': sqlite3.sqlite_version,
+                       'time': datetime.datetime.now().isoformat()},
+              'results': results}
+    with open(args.output, 'w') as f:
+        json.dump(output, f, indent = 2, sort_keys = True)
+
+    if args.compare != None:
+        with open(args.compare) as f:
+            compare(results, json.load(f)['results'])
+
+if __name__ == '__main__':
+    main()
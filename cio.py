@@ -2,6 +2,7 @@ import sys
 import datetime, time
 import model
 import debug
+import layout
 
 class CancelException(Exception):
     pass
@@ -12,40 +13,60 @@ class PreviousException(Exception):
 class NewException(Exception):
     pass
 
-def utf8_len(s):
-    result = 0
-    for i in range(len(s)):
-        if ord(s[i]) & 0xc0 != 0x80:
-            result += 1
-    return result
-
-def utf8_break(s, n):
-    result = ""
-    more   = ""
-    rest   = ""
-    for i in range(len(s)):
-        if ord(s[i]) & 0xc0 != 0x80:
-            if   n == 0:
-                rest = more + s[i:]
-                break
-            elif s[i] == " ":
-                if result != "":
-                    result += " "
-                result += more
-                more = ""
-            else:
-                more += s[i]
-            n -= 1
-        else:
-            more += s[i]
-    if result == "":
-        result = more
-        rest = ""
-    return result, rest
-
 class cio:
 
+    def __init__(self):
+        # Between begin() and end() output is kept in buffer and written in
+        # one go when done, before reading input, or a screenful of rows at
+        # a time when paging; output after the user declines to see more is
+        # dropped until the next prompt.
+        self.buffer = None
+        self.lines = 0
+        self.rows = 0
+        self.paging = False
+        self.discarding = False
+        layout.watch_resizes()
+
+    def begin(self, paging = True):
+        self.buffer = []
+        self.lines = 0
+        self.rows = self.dimensions()[1]
+        self.paging = paging and not debug.BATCH
+        self.discarding = False
+
+    def end(self):
+        self.flush()
+        self.buffer = None
+
+    def flush(self):
+        if self.buffer:
+            sys.stdout.write("".join(self.buffer))
+            del self.buffer[:]
+        sys.stdout.flush()
+
+    def emit(self, s):
+        if self.buffer == None:
+            sys.stdout.write(s)
+            sys.stdout.flush()
+            return
+        if self.discarding:
+            return
+        self.buffer.append(s)
+        if self.paging:
+            self.lines += s.count("\n")
+            if self.lines >= self.rows - 1:
+                self.more()
+
+    def more(self):
+        try:
+            self.read_line(0, "More.")
+        except CancelException:
+            self.discarding = True
+
     def print_prompt(self, level, question):
+        self.flush()
+        self.lines = 0
+        self.discarding = False
         if not debug.BATCH:
             if question != None:
                 print("  " * level + "! " + question)
@@ -168,10 +189,10 @@ class cio:
 
     def print_status(self, level, status):
         if not debug.BATCH:
-            print("  " * level + "= %s" %(status))
+            self.emit("  " * level + "= %s\n" %(status))
 
     def print_error(self, level, message):
-        print("  " * level + "* " + message)
+        self.emit("  " * level + "* " + message + "\n")
 
     ATTR_RESET = 0
     ATTR_BRIGHT = 1
@@ -191,22 +212,17 @@ class cio:
     COLOR_WHITE = 7
 
     def text_color(self, attr, fg, bg):
-        sys.stdout.write(("%c[%d;%d;%dm" % (0x1b, attr, fg + 30, bg + 40)))
-        sys.stdout.flush()
+        self.emit("%c[%d;%d;%dm" % (0x1b, attr, fg + 30, bg + 40))
 
 
     def write(self, s):
-        sys.stdout.write(s)
-        sys.stdout.flush()
+        self.emit(s)
 
     def writeln(self, s, level = 0):
-        print("  " * level + s)
+        self.emit("  " * level + s + "\n")
 
     def dimensions(self):
-        import fcntl
-        import termios
-        result = fcntl.ioctl(1, termios.TIOCGWINSZ, "\0\0\0\0\0\0\0\0")
-        return ord(result[2]), ord(result[0])
+        return layout.dimensions()
 
     def columns(self):
         return self.dimensions()[0]
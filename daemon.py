@@ -0,0 +1,236 @@
+import argparse
+import datetime
+import json
+import os
+import sqlite3
+import sys
+import debug
+import model
+
+try:
+    import socketserver
+except ImportError:
+    import SocketServer as socketserver
+
+# Answers JSON-lines requests with one Database kept open, so scripts and
+# scanner hooks skip interpreter start-up and keep the caches warm. Each
+# request is an object with "method", optional "params" and an optional
+# "id" echoed back; each reply carries "result" or "error".
+#
+#   {"id": 1, "method": "search", "params": {"kind": "packages", "pattern": "arroz"}}
+#   {"id": 2, "method": "add_price", "params": {"store_id": 1, "barcode": "7891234567895", "price": 1099}}
+#   {"id": 3, "method": "price_summary", "params": {"product_name": "arroz", "limit": 20}}
+#   {"id": 4, "method": "prices", "params": {"package_id": 12, "order": "id", "limit": 10}}
+
+class RequestError(Exception):
+    pass
+
+def to_json(record):
+    result = {}
+    for key, value in record.items():
+        if isinstance(value, datetime.date):
+            value = value.isoformat()
+        result[key] = value
+    return result
+
+class Daemon:
+
+    SEARCHES = ['brands', 'stores', 'products', 'packages']
+
+    FILTER_FIELDS = ['product_name', 'product_extra', 'package_extra', 'brand_name']
+
+    def __init__(self, db):
+        self.db = db
+
+    def handle_line(self, line):
+        try:
+            request = json.loads(line)
+        except ValueError:
+            return json.dumps({'id': None, 'error': "Invalid JSON."})
+        if not isinstance(request, dict):
+            return json.dumps({'id': None, 'error': "Requests must be objects."})
+        params = request.get('params')
+        if params == None:
+            params = {}
+        reply = self.handle_request(request.get('method'), params)
+        reply['id'] = request.get('id')
+        return json.dumps(reply)
+
+    def handle_request(self, method, params):
+        # Whatever goes wrong is answered with an error, so that one bad
+        # request doesn't end the daemon.
+        try:
+            self.db.sync()
+            if not isinstance(params, dict):
+                raise RequestError("Params must be an object.")
+            return {'result': self.handle(method, params)}
+        except (RequestError, sqlite3.Error) as e:
+            self.db.rollback()
+            return {'error': str(e)}
+        except Exception as e:
+            self.db.rollback()
+            return {'error': "Internal error: %s: %s" % (type(e).__name__, e)}
+
+    def handle(self, method, params):
+        if   method == "ping":
+            return "pong"
+        elif method == "search":
+            return self.search(params)
+        elif method == "add_price":
+            return self.add_price(params)
+        elif method == "price_summary":
+            return self.price_summary(params)
+        elif method == "prices":
+            return self.prices(params)
+        else:
+            raise RequestError("Unknown method: %s." % (method,))
+
+    def string(self, params, name, default = None):
+        value = params.get(name)
+        if value == None:
+            if default == None:
+                raise RequestError("Missing %s." % (name,))
+            return default
+        if not isinstance(value, model.TEXT_TYPES):
+            raise RequestError("%s must be a string." % (name,))
+        return value
+
+    def integer(self, params, name, required = True):
+        value = params.get(name)
+        if value == None:
+            if required:
+                raise RequestError("Missing %s." % (name,))
+            return None
+        if isinstance(value, bool) or not isinstance(value, model.INTEGER_TYPES):
+            raise RequestError("%s must be an integer." % (name,))
+        return value
+
+    def search(self, params):
+        kind = self.string(params, 'kind', 'packages')
+        if kind not in self.SEARCHES:
+            raise RequestError("Unknown kind: %s." % (kind,))
+        pattern = self.string(params, 'pattern')
+        fuzzy = params.get('fuzzy', True)
+        if not isinstance(fuzzy, bool):
+            raise RequestError("fuzzy must be true or false.")
+        records = getattr(self.db, 'search_' + kind)(pattern, self.limit(params))
+        if kind == 'packages':
+            records = self.db.get_package_by_barcode(pattern) + records
+        if len(records) == 0 and fuzzy:
+            records = getattr(self.db, 'fuzzy_search_' + kind)(pattern)
+        return [to_json(record) for record in records]
+
+    def add_price(self, params):
+        if params.get('barcode') != None:
+            barcode = self.string(params, 'barcode')
+            packages = self.db.get_package_by_exact_barcode(barcode)
+            if len(packages) != 1:
+                raise RequestError("Unknown barcode: %s." % (barcode,))
+            package_id = packages[0]['id']
+        else:
+            package_id = self.integer(params, 'package_id')
+        date = datetime.date.today()
+        if params.get('date') != None:
+            try:
+                date = model.parse_date(self.string(params, 'date'))
+            except ValueError:
+                raise RequestError("Invalid date: %s." % (params['date'],))
+        origin = self.string(params, 'origin', 'offline')
+        origin_no = model.origin_by_name(origin)
+        if origin_no == None:
+            raise RequestError("Unknown origin: %s." % (origin,))
+        price = self.db.insert_price(self.integer(params, 'store_id'), package_id, self.integer(params, 'price'), date, origin_no)
+        self.db.save()
+        return price['id']
+
+    def filter_specs(self, params):
+        filter_specs = []
+        for field in self.FILTER_FIELDS:
+            if params.get(field) != None:
+                filter_specs.append({'field': field, 'match': 'fuzzy', 'value': self.string(params, field)})
+        for field in ['package_id', 'product_id']:
+            if params.get(field) != None:
+                filter_specs.append({'field': field, 'match': 'exact', 'value': self.integer(params, field)})
+        return filter_specs
+
+    def limit(self, params):
+        return self.integer(params, 'limit', required = False)
+
+    def price_summary(self, params):
+        after = params.get('after')
+        if after != None:
+            numbers = model.INTEGER_TYPES + (float,)
+            if not isinstance(after, list) or len(after) != 3 or [value for value in after if isinstance(value, bool) or not isinstance(value, numbers)]:
+                raise RequestError("after must be a list of day, unit price and id.")
+            after = tuple(after)
+        highlight_id = self.integer(params, 'highlight_id', required = False)
+        prices = self.db.get_price_summary(self.filter_specs(params), highlight_id, after, self.limit(params))
+        return [to_json(price) for price in prices]
+
+    def prices(self, params):
+        # Newest first when ordered by id, oldest first otherwise.
+        order = None
+        if params.get('order') == 'id':
+            order = 'id'
+        prices = self.db.get_prices_with_filter(self.filter_specs(params), order, self.limit(params))
+        return [to_json(price) for price in prices]
+
+    def serve_stream(self, input, output):
+        while True:
+            line = input.readline()
+            if len(line) == 0:
+                break
+            if len(line.strip()) == 0:
+                continue
+            output.write(self.handle_line(line) + "\n")
+            output.flush()
+
+class Handler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        while True:
+            line = self.rfile.readline()
+            if len(line) == 0:
+                break
+            if len(line.strip()) == 0:
+                continue
+            if not isinstance(line, str):
+                line = line.decode('utf-8')
+            reply = self.server.daemon.handle_line(line) + "\n"
+            self.wfile.write(reply.encode('utf-8'))
+
+class UnixServer(socketserver.UnixStreamServer):
+
+    # Requests are answered one at a time, as they share one connection.
+    def __init__(self, path, daemon):
+        socketserver.UnixStreamServer.__init__(self, path, Handler)
+        self.daemon = daemon
+
+def main():
+    parser = argparse.ArgumentParser(description = "Answer JSON-lines requests about prices.")
+    parser.add_argument('--database', default = 'hieroch.db')
+    parser.add_argument('--socket', help = "listen on this Unix socket instead of stdin/stdout")
+    args = parser.parse_args()
+
+    db = model.Database(args.database, debug.JOURNAL_MODE, debug.SYNCHRONOUS, None, debug.RESULT_CACHE_SIZE,
+                        busy_timeout = debug.BUSY_TIMEOUT, retries = debug.WRITE_RETRIES)
+    daemon = Daemon(db)
+    try:
+        if args.socket == None:
+            daemon.serve_stream(sys.stdin, sys.stdout)
+        else:
+            if os.path.exists(args.socket):
+                os.unlink(args.socket)
+            server = UnixServer(args.socket, daemon)
+            try:
+                server.serve_forever()
+            except KeyboardInterrupt:
+                pass
+            finally:
+                server.server_close()
+                os.unlink(args.socket)
+    finally:
+        db.save()
+
+if __name__ == '__main__':
+    main()
@@ -18,7 +18,7 @@ CREATE TABLE products(
   name  VARCHAR(128) NOT NULL,
   extra VARCHAR(128) NOT NULL DEFAULT "",
   unit  INTEGER      NOT NULL,
-  hide  INTEGER      NOT NULL DEFAULT 0
+  hide  INTEGER      NOT NULL DEFAULT 0,
 
   UNIQUE(name, extra)
 );
@@ -1,11 +1,74 @@
+import model
+import os
+import sys
+
 DEBUG       = False
 BATCH       = False
+PROFILE     = False
+EXPLAIN     = False
+
+# Storage settings; None leaves SQLite's default in place. WAL lets readers
+# go on while another process writes.
+JOURNAL_MODE = 'wal'
+SYNCHRONOUS  = None
+
+# Seconds a write waits for another process to release the database, and
+# how many times it's tried again (after a growing pause) if that's not
+# enough.
+BUSY_TIMEOUT  = 5.0
+WRITE_RETRIES = 5
+
+# In BATCH runs, commit after this many commands, or once this many seconds
+# have passed since the last commit, whichever comes first. Other writers
+# wait while a batch is open, including while the script's next line is
+# awaited, so this is for input that's read straight through. By default,
+# and always in interactive runs, every write is committed at once.
+COMMIT_EVERY   = 1
+COMMIT_SECONDS = None
+
+# Number of price lists kept by Database between commands; 0 turns it off.
+RESULT_CACHE_SIZE = 32
+
+def setting(name, parse, default):
+    # The value of an environment variable, or default if it's unset or
+    # isn't valid (which is reported).
+    if name not in os.environ:
+        return default
+    try:
+        return parse(os.environ[name])
+    except ValueError:
+        sys.stderr.write("Ignoring %s=%s: not a valid value.\n" % (name, os.environ[name]))
+        return default
+
+def at_least(parse, minimum):
+    def parse_number(value):
+        value = parse(value)
+        if not value >= minimum:
+            raise ValueError(value)
+        return value
+    return parse_number
+
+def one_of(choices):
+    def parse_choice(value):
+        if value.lower() not in choices:
+            raise ValueError(value)
+        return value.lower()
+    return parse_choice
+
+if 'DEBUG' in os.environ:
+    DEBUG = True
+if 'BATCH' in os.environ:
+    BATCH = True
+if 'PROFILE' in os.environ:
+    PROFILE = True
+if 'EXPLAIN' in os.environ:
+    PROFILE = True
+    EXPLAIN = True
 
-try:
-    import os
-    if 'DEBUG' in os.environ:
-        DEBUG = True
-    if 'BATCH' in os.environ:
-        BATCH = True
-except:
-    pass
+JOURNAL_MODE      = setting('JOURNAL_MODE', one_of(model.Database.JOURNAL_MODES), JOURNAL_MODE)
+SYNCHRONOUS       = setting('SYNCHRONOUS', one_of(model.Database.SYNCHRONOUS_LEVELS), SYNCHRONOUS)
+BUSY_TIMEOUT      = setting('BUSY_TIMEOUT', at_least(float, 0), BUSY_TIMEOUT)
+WRITE_RETRIES     = setting('WRITE_RETRIES', at_least(int, 0), WRITE_RETRIES)
+COMMIT_EVERY      = setting('COMMIT_EVERY', at_least(int, 1), COMMIT_EVERY)
+COMMIT_SECONDS    = setting('COMMIT_SECONDS', at_least(float, 0), COMMIT_SECONDS)
+RESULT_CACHE_SIZE = setting('RESULT_CACHE_SIZE', at_least(int, 0), RESULT_CACHE_SIZE)
@@ -1,41 +1,85 @@
 import sys
 import datetime, time
+import analytics
 import cio
+import importer
+import instrument
+import layout
 import model
+import shopping
+import trend
+import debug
 from debug import DEBUG
 
 class cli:
 
-    def run(self):
-        self.db = model.Database('hieroch.db')
+    def run(self, database_path = 'hieroch.db'):
+        self.profiler = None
+        if debug.PROFILE:
+            self.profiler = instrument.Profiler(explain = debug.EXPLAIN)
+        # An open write transaction keeps other writers out, so commits are
+        # only batched when commands come from a script, not while waiting
+        # on someone at the terminal.
+        commit_writes = not debug.BATCH or (debug.COMMIT_EVERY == 1 and debug.COMMIT_SECONDS == None)
+        self.db = model.Database(database_path, debug.JOURNAL_MODE, debug.SYNCHRONOUS, self.profiler, debug.RESULT_CACHE_SIZE,
+                                 busy_timeout = debug.BUSY_TIMEOUT, retries = debug.WRITE_RETRIES, commit_writes = commit_writes)
         self.cio = cio.cio()
+        self.analytics = analytics.Analytics(self.db)
+        self.planner = shopping.Planner(self.db)
         self.cio.print_status(0, "Hieroch.")
 
         self.store_id  = None
         self.today  = datetime.date.today()
+        self.current_day = self.today.toordinal()
         self.origin_no = model.origin_by_name('offline')
 
-        self.loop()
-
-        self.db.save()
+        try:
+            self.loop()
+        finally:
+            self.db.save()
 
     def loop(self):
+        pending = 0
+        last_commit = time.time()
         while True:
             line = self.cio.read_line(0).strip()
+            # Day number of the real date, for how old the prices shown are.
+            self.current_day = datetime.date.today().toordinal()
+            self.db.sync()
             quit = False
-            if DEBUG:
-                quit = self.command(line)
-            else:
-                try:
-                    quit = self.command(line)
-                except cio.PreviousException:
-                    pass
-                except Exception as e:
-                    self.cio.writeln(str(e))
-            self.db.save()
+            failed = False
+            self.cio.begin()
+            try:
+                if DEBUG:
+                    quit = self.timed_command(line)
+                else:
+                    try:
+                        quit = self.timed_command(line)
+                    except cio.PreviousException:
+                        pass
+                    except Exception as e:
+                        self.cio.writeln(str(e))
+                        failed = True
+            finally:
+                self.cio.end()
+            pending += 1
+            if failed or pending >= debug.COMMIT_EVERY or (debug.COMMIT_SECONDS != None and time.time() - last_commit >= debug.COMMIT_SECONDS):
+                self.db.save()
+                pending = 0
+                last_commit = time.time()
             if quit:
                 break
 
+    def timed_command(self, cmd):
+        if self.profiler == None or len(cmd) == 0:
+            return self.command(cmd)
+        start = time.time()
+        sql_time = self.profiler.sql_time
+        try:
+            return self.command(cmd)
+        finally:
+            self.profiler.record_command(cmd, time.time() - start, self.profiler.sql_time - sql_time)
+
     def command(self, cmd):
         if len(cmd) == 0:
             return
@@ -78,8 +122,26 @@ class cli:
             self.hide_package(1)
         elif cmd == "hr":
             self.hide_product(1)
+        elif cmd == "i":
+            self.import_prices(1)
         elif cmd == "check":
             self.run_checks()
+        elif cmd == "check full":
+            self.run_checks(full = True)
+        elif cmd == "stats":
+            self.print_stats(1)
+        elif cmd == "tw":
+            self.view_package_trend(1)
+        elif cmd == "tr":
+            self.view_product_trend(1)
+        elif cmd == "l":
+            self.plan_shopping(1)
+        elif cmd == "rp":
+            self.report_products(1)
+        elif cmd == "rs":
+            self.report_stores(1)
+        elif cmd == "rm":
+            self.report_months(1)
         elif cmd == "q":
             return True
         else:
@@ -91,98 +153,150 @@ class cli:
         self.store_id = store['id']
         return self.store_id
 
-    def run_checks(self):
-
-        def multiply(s, package_unit):
-            s = s + " "
-            i = 0
-            a = 0
-            nums = []
-            snum = ""
-            sunit = ""
-            while i < len(s):
-                c = s[i]
-                if   a == 0:
-                    if   c >= '0' and c <= '9':
-                        snum = c
-                        sunit = ""
-                        a = 1
-                elif a == 1:
-                    if   c == " ":
-                        nums.append([snum, sunit])
-                        a = 2
-                    else:
-                        if (c >= '0' and c <= '9') or c == '.':
-                            snum += c
-                        else:
-                            sunit += c
-                elif a == 2:
-                    if   c == " ":
-                        a = 0
-                i += 1
-            if len(nums) > 1:
-                value = 1.0
-                for num, unit in nums:
-                    if   unit == "u" or unit == package_unit or (unit + "2") == package_unit:
-                        value *= float(num)
-                    elif unit == "cm" and (package_unit == "m" or package_unit == "m2"):
-                        value *= float(num) / 100.0
-                    else:
-                        raise Exception("Don't know what to do with units: %s and %s." % (unit, package_unit))
-                return value
-            else:
-                return None
-
-        packages = self.db.get_all_packages()
-        for package in packages:
-            if package['barcode']:
-                if not model.is_barcode_valid(package['barcode']):
-                    self.cio.writeln("Invalid barcode for package %d: %s" % (package['id'], package['barcode']))
-
-        packages = self.db.get_all_packages()
+    def run_checks(self, full = False):
+        # Unless asked for a full run, each check only examines the rows
+        # added since its last run, as recorded by its mark.
+        checks = []
+        checks.append(("barcodes", "packages", "Bar codes",       self.check_barcodes))
+        checks.append(("amounts",  "packages", "Package amounts", self.check_amounts))
+        checks.append(("prices",   "prices",   "Repeated prices", self.check_repeated_prices))
+        for mark, table, name, check in checks:
+            start = time.time()
+            since_id = 0
+            if not full:
+                since_id = self.db.get_check_mark(mark)
+            last_id = self.db.get_last_id(table)
+            check(since_id)
+            self.db.set_check_mark(mark, last_id)
+            self.cio.print_status(0, "%s checked in %.3fs." % (name, time.time() - start))
+
+    def check_barcodes(self, since_id):
+        for package in self.db.get_packages_with_barcode(since_id):
+            if not model.is_barcode_valid(package['barcode']):
+                self.cio.writeln("Invalid barcode for package %d: %s" % (package['id'], package['barcode']))
+
+    def check_amounts(self, since_id):
+        packages = self.prefetch_packages(self.db.get_packages_since(since_id))
+        products = self.db.get_products_by_ids([package['product_id'] for package in packages])
         for package in packages:
-            unit = model.unit_by_no(self.db.get_product_by_id(package['product_id'])['unit'])
-            value = multiply(package['extra'], unit)
+            unit = model.unit_by_no(products[package['product_id']]['unit'])
+            value = model.amount_from_extra(package['extra'], unit)
             if value != None:
                 if value != package['amount']:
                     self.cio.writeln("Suspect amount:")
                     self.cio.writeln(self.format_package(package, verbose = True))
 
-        prices = self.db.get_all_prices()
-        for i in range(len(prices)):
-            if prices[i]['sic'] == 1:
-                continue
-            if i > 0:
-                same = ['origin', 'store_id', 'price', 'package_id', 'date']
-                count = 0
-                for attr in same:
-                    if prices[i][attr] == prices[i - 1][attr]:
-                        count += 1
-                if count > 3:
-                    self.cio.writeln("{0} // {1}".format(prices[i - 1]['id'], prices[i]['id']))
-                    for attr in same:
-                        if prices[i][attr] != prices[i - 1][attr]:
-                            if attr == 'package_id':
-                                pkg1 = self.db.get_package_by_id(prices[i - 1]['package_id'])
-                                pkg2 = self.db.get_package_by_id(prices[i    ]['package_id'])
-                                self.cio.writeln("package:")
-                                self.cio.writeln("        " + self.format_package(pkg1, verbose = True))
-                                self.cio.writeln("        --")
-                                self.cio.writeln("        " + self.format_package(pkg2, verbose = True))
-                            else:
-                                pkg = self.db.get_package_by_id(prices[i]['package_id'])
-                                self.cio.writeln("        " + self.format_package(pkg, verbose = True))
-                                self.cio.writeln("{0}: {1} -- {2}".format(attr, prices[i - 1][attr], prices[i][attr]))
+    def check_repeated_prices(self, since_id):
+        pairs = self.db.get_similar_adjacent_prices(since_id)
+        package_ids = set()
+        for previous, price in pairs:
+            package_ids.add(previous['package_id'])
+            package_ids.add(price['package_id'])
+        packages = self.db.get_packages_by_ids(package_ids)
+        self.prefetch_packages(packages.values())
+
+        same = ['origin', 'store_id', 'price', 'package_id', 'date']
+        for previous, price in pairs:
+            self.cio.writeln("{0} // {1}".format(previous['id'], price['id']))
+            for attr in same:
+                if price[attr] != previous[attr]:
+                    if attr == 'package_id':
+                        self.cio.writeln("package:")
+                        self.cio.writeln("        " + self.format_package(packages[previous['package_id']], verbose = True))
+                        self.cio.writeln("        --")
+                        self.cio.writeln("        " + self.format_package(packages[price['package_id']], verbose = True))
+                    else:
+                        self.cio.writeln("        " + self.format_package(packages[price['package_id']], verbose = True))
+                        self.cio.writeln("{0}: {1} -- {2}".format(attr, previous[attr], price[attr]))
+
+    def print_stats(self, level):
+        self.cio.writeln("Result cache: {0} hits, {1} misses, {2} of {3} entries.".format(self.db.result_hits, self.db.result_misses, len(self.db.results), self.db.result_cache_size), level)
+        if self.profiler == None:
+            self.cio.print_error(level, "Profiling is off; set PROFILE (or EXPLAIN) to turn it on.")
+            return
+        self.cio.writeln("Commands:", level)
+        self.cio.writeln("{0:>6} {1:>10} {2:>10} {3:>10}  {4}".format("calls", "total ms", "sql ms", "other ms", "command"), level)
+        commands = sorted(self.profiler.commands.items(), key = lambda item: -item[1][1])
+        for command, (calls, seconds, sql_seconds) in commands:
+            self.cio.writeln("{0:>6} {1:>10.1f} {2:>10.1f} {3:>10.1f}  {4}".format(calls, seconds * 1000, sql_seconds * 1000, (seconds - sql_seconds) * 1000, command), level)
+        self.cio.writeln("Statements:", level)
+        self.cio.writeln("{0:>6} {1:>8} {2:>10}  {3}".format("calls", "rows", "total ms", "statement"), level)
+        for sql, calls, rows, seconds in self.profiler.hottest_statements():
+            self.cio.writeln("{0:>6} {1:>8} {2:>10.1f}  {3}".format(calls, rows, seconds * 1000, sql[0:100]), level)
+        for sql, plan in self.profiler.full_scans():
+            self.cio.writeln("Full scan of prices: " + sql[0:100], level)
+            for detail in plan:
+                self.cio.writeln("  " + detail, level)
+
+    def read_report_form(self, level):
+        # Returns the ids of the products named (None for all of them) and
+        # the day number to start from (None for the whole history).
+        options = []
+        options.append({'type': 'string', 'question': "~Product name.", 'null': True})
+        options.append({'type': 'date',   'question': "~Since.",        'null': True})
+        values = self.read_form(level, options)
+        product_ids = None
+        if values[0] != None:
+            product_ids = [product['id'] for product in self.db.search_products(values[0])]
+        since_day = None
+        if values[1] != None:
+            since_day = values[1].toordinal()
+        return product_ids, since_day
+
+    def check_analytics(self, level):
+        if not analytics.import_numpy():
+            self.cio.print_error(level, "Reports need NumPy.")
+            return False
+        return True
+
+    def report_products(self, level):
+        if not self.check_analytics(level):
+            return
+        self.cio.print_status(level, "Unit prices per product.")
+        product_ids, since_day = self.read_report_form(level)
+        rows = self.analytics.product_summary(since_day, product_ids)
+        products = self.db.get_products_by_ids([row[0] for row in rows])
+        rows.sort(key = lambda row: (products[row[0]]['name'], products[row[0]]['extra']))
+        self.cio.writeln("{0:>6} {1:>9} {2:>9} {3:>9} {4:>9}  {5}".format("count", "min", "p25", "median", "p75", "product"), level)
+        for product_id, count, minimum, (p25, median, p75) in rows:
+            product = products[product_id]
+            unit_spec = model.normalized_unit_by_no(product['unit'])[0]
+            name = product['name']
+            if product['extra'] != "":
+                name += " " + product['extra']
+            self.cio.writeln("{0:>6} {1:>9.2f} {2:>9.2f} {3:>9.2f} {4:>9.2f}  {5}/{6}".format(count, minimum / 100.0, p25 / 100.0, median / 100.0, p75 / 100.0, name, unit_spec), level)
+
+    def report_stores(self, level):
+        if not self.check_analytics(level):
+            return
+        self.cio.print_status(level, "Price index per store (100 is the usual price).")
+        product_ids, since_day = self.read_report_form(level)
+        rows = self.analytics.store_index(since_day, product_ids)
+        stores = self.db.get_stores_by_ids([row[0] for row in rows])
+        rows.sort(key = lambda row: row[2])
+        self.cio.writeln("{0:>7} {1:>9}  {2}".format("index", "products", "store"), level)
+        for store_id, count, index in rows:
+            self.cio.writeln("{0:>7.1f} {1:>9}  {2}".format(index, count, stores[store_id]['name']), level)
+
+    def report_months(self, level):
+        if not self.check_analytics(level):
+            return
+        self.cio.print_status(level, "Price index per month (100 is the usual price).")
+        product_ids, since_day = self.read_report_form(level)
+        rows = self.analytics.month_index(since_day, product_ids)
+        self.cio.writeln("{0:>7} {1:>7} {2:>9}".format("month", "index", "products"), level)
+        for month, count, index in rows:
+            self.cio.writeln("{0:>7} {1:>7.1f} {2:>9}".format(analytics.month_name(month), index, count), level)
 
     def ensure_store(self, level):
         if self.store_id != None:
             return
         return self.set_store(level)
 
-    def choose(self, level, items, format, new, previous):
+    def choose(self, level, items, format, new, previous, confirm = False):
         if len(items) == 0:
             return None
-        if len(items) == 1:
+        if len(items) == 1 and not confirm:
             return items[0]
 
         for i in reversed(range(len(items))):
@@ -192,13 +306,20 @@ class cli:
             if n >= 1 and n <= len(items):
                 return items[n - 1]
 
-    def choose_record(self, level, question, add_function, fetch_function, format_function, null = False, new = False, previous = False):
+    def choose_record(self, level, question, add_function, fetch_function, format_function, null = False, new = False, previous = False, fuzzy_function = None):
         while True:
             try:
                 pattern = self.cio.read_string(level, question, null = null, new = new, previous = previous)
                 if pattern == None:
                     return None
-                value = self.choose(level + 1, fetch_function(pattern), format_function, new = new, previous = previous)
+                items = fetch_function(pattern)
+                confirm = False
+                if len(items) == 0 and fuzzy_function != None:
+                    items = fuzzy_function(pattern)
+                    confirm = True
+                    if len(items) > 0:
+                        self.cio.print_status(level, "No exact match; closest records:")
+                value = self.choose(level + 1, items, format_function, new = new, previous = previous, confirm = confirm)
                 if value != None:
                     return value
             except cio.NewException:
@@ -206,23 +327,28 @@ class cli:
                     return add_function(level + 1)
 
     def choose_store(self, level, null = False, new = False, previous = False):
-        store = self.choose_record(level, "~Store.", self.add_store, self.db.get_store_by_name, lambda r: r['name'], null = null, new = new, previous = previous)
+        store = self.choose_record(level, "~Store.", self.add_store, self.db.search_stores, lambda r: r['name'], null = null, new = new, previous = previous, fuzzy_function = self.db.fuzzy_search_stores)
         if store != None:
             self.cio.print_status(level, store['name'])
         return store
 
     def choose_product(self, level, null = False, new = False, previous = False):
-        product = self.choose_record(level, "~Product name.", self.add_product, self.db.get_product_by_name, self.format_product, null = null, new = new, previous = previous)
+        product = self.choose_record(level, "~Product name.", self.add_product, self.db.search_products, self.format_product, null = null, new = new, previous = previous, fuzzy_function = self.db.fuzzy_search_products)
         if product != None:
             self.cio.print_status(level, self.format_product(product))
         return product
 
     def choose_brand(self, level, null = False, new = False, previous = False):
-        brand = self.choose_record(level, "~Brand name.", self.add_brand, self.db.get_brand_by_name, lambda r: r['name'], null = null, new = new, previous = previous)
+        brand = self.choose_record(level, "~Brand name.", self.add_brand, self.db.search_brands, lambda r: r['name'], null = null, new = new, previous = previous, fuzzy_function = self.db.fuzzy_search_brands)
         if brand != None:
             self.cio.print_status(level, brand['name'])
         return brand
 
+    def prefetch_packages(self, packages):
+        self.db.get_products_by_ids([package['product_id'] for package in packages])
+        self.db.get_brands_by_ids([package['brand_id'] for package in packages])
+        return packages
+
     def format_package(self, package, product = None, verbose = False):
         if product == None:
             product = self.db.get_product_by_id(package['product_id'])
@@ -263,9 +389,12 @@ class cli:
 
     def choose_package(self, level, null = False, new = False, previous = False):
         def fetch_packages(pattern):
-            return self.db.get_package_by_barcode(pattern) + self.db.get_package_by_product_name_or_extra(pattern)
+            return self.prefetch_packages(self.db.get_package_by_barcode(pattern) + self.db.search_packages(pattern))
 
-        package = self.choose_record(level, "~Bar code/~Product name.", self.add_package, fetch_packages, self.format_package, null = null, new = new, previous = previous)
+        def fuzzy_packages(pattern):
+            return self.prefetch_packages(self.db.fuzzy_search_packages(pattern))
+
+        package = self.choose_record(level, "~Bar code/~Product name.", self.add_package, fetch_packages, self.format_package, null = null, new = new, previous = previous, fuzzy_function = fuzzy_packages)
         if package != None:
             self.cio.print_status(level, self.format_package(package))
         return package
@@ -293,6 +422,7 @@ class cli:
                 elif option['type'] == 'float':    value = self.cio.read_float  (level, question, null = null, previous = True)
                 elif option['type'] == 'money':    value = self.cio.read_money  (level, question, null = null, previous = True)
                 elif option['type'] == 'unit':     value = self.cio.read_unit   (level, question, null = null, previous = True)
+                elif option['type'] == 'date':     value = self.cio.read_date   (level, question, null = null, previous = True)
                 else:
                     raise Exception("Unknown type: %s." % (option['type'],))
             except cio.PreviousException:
@@ -338,9 +468,8 @@ class cli:
         package, price = self.read_form(level, options)
         price = self.db.insert_price(self.store_id, package['id'], price, self.today, self.origin_no)
 
-        filter_specs = [{'field': 'product_id', 'match': 'exact', 'value': package['product_id']}]
-        prices = self.db.get_prices_with_filter(filter_specs)
-        self.print_best_price_summary(prices, price['id'])
+        prices = self.db.get_best_prices_by_product(package['product_id'], price['id'])
+        self.print_best_price_table(prices, price['id'])
 
         return price
 
@@ -375,21 +504,11 @@ class cli:
     def format_price(self, price, multiline = False):
         s = ""
 
-        rate = price['price'] / 100.0 / price['package_amount']
-        unit_spec = model.unit_by_no(price['product_unit'])
-        if  unit_spec == 'g':
-            unit_spec = 'kg'
-            rate = rate * 1000
-        elif unit_spec == 'ml':
-            unit_spec = 'l'
-            rate = rate * 1000
-        elif unit_spec == 'm':
-            unit_spec = 'km'
-            rate = rate * 1000
-        rate = "{0:03.2f}/{1}".format(rate, unit_spec)
+        unit_spec = model.normalized_unit_by_no(price['product_unit'])[0]
+        rate = "{0:03.2f}/{1}".format(price['unit_price'] / 100.0, unit_spec)
         spec = self.format_package_raw(price['product_name'], price['product_extra'], price['package_extra'], price['brand_name'], price['package_amount'], price['product_unit'])
 
-        ago = (datetime.date.today() - price['date']).days
+        ago = self.current_day - price['day']
         if   ago <= 90:
             ago = "{0:>2}d".format(ago)
         elif ago <= (36 * 30):
@@ -415,20 +534,12 @@ class cli:
             return s
 
         cols = self.cio.columns()
-        len_s = cio.utf8_len(s)
-        len_spec = cio.utf8_len(spec)
+        len_s = layout.width(s)
+        len_spec = layout.width(spec)
         if (len_s >= cols) or (len_s + len_spec <= cols):
             s += spec
         else:
-            left = len_s
-            rem = cols - len_s
-            first = True
-            while cio.utf8_len(spec) > 0:
-                if not first:
-                    s += "\n" + (" " * left)
-                first = False
-                trunc, spec = cio.utf8_break(spec, rem)
-                s += trunc
+            s += ("\n" + " " * len_s).join(layout.wrap(spec, cols - len_s))
         return s
 
     def print_price(self, price, multiline = False):
@@ -442,37 +553,129 @@ class cli:
         self.cio.text_color(self.cio.ATTR_RESET, self.cio.COLOR_WHITE, self.cio.COLOR_BLACK)
         self.cio.write("\n")
 
-    def print_best_price_summary(self, prices, highlight_id = None):
-        minimum = float("inf")
-        selected = []
-        packages = set()
-        for price in reversed(prices):
-            rate = price['price'] / 100.0 / price['package_amount']
-            append = False
-            if rate < minimum:
-                append = True
-                minimum = rate
-                price['good'] = True
-            elif price['id'] == highlight_id:
+    def print_price_summary(self, level, filter_specs, highlight_id = None):
+        # When paging, the summary is read and printed a screenful at a
+        # time, newest prices first; cio's pager asks before going on, and
+        # once the user declines no more pages are read. Otherwise the whole
+        # history is printed oldest first.
+        page_size = None
+        if self.cio.paging:
+            page_size = max(1, self.cio.rows - 2)
+        after = None
+        while True:
+            prices = self.db.get_price_summary(filter_specs, highlight_id, after, page_size)
+            if page_size == None:
+                prices.reverse()
+            for price in prices:
+                self.print_price(price, multiline = True)
+            if page_size == None or len(prices) < page_size or self.cio.discarding:
+                return
+            after = model.summary_key(prices[-1])
+
+    def import_prices(self, level):
+        self.cio.print_status(level, "Importing prices.")
+        path = self.cio.read_string(level, "File (CSV or JSON lines).")
+        count, unmatched = importer.Importer(self.db).run(path, self.origin_no)
+        for number, reason in unmatched:
+            self.cio.print_error(level, "Line %d: %s" % (number, reason))
+        self.cio.print_status(level, "Imported %d prices, %d rows left out." % (count, len(unmatched)))
+
+    def print_best_price_table(self, prices, highlight_id = None):
+        # Prices are the best and latest ones of each package, oldest first.
+        if len(prices) > 0:
+            best = min(prices, key = lambda price: price['unit_price'])
+            best['good'] = True
+        for price in prices:
+            if price['id'] == highlight_id and 'good' not in price:
                 price['highlight'] = True
-                append = True
-            elif price['package_id'] not in packages:
-                append = True
-            packages.add(price['package_id'])
-            if append:
-                price['discarded_count'] = 0
-                selected.append(price)
-            else:
-                selected[-1]['discarded_count'] += 1
-
-        for price in reversed(selected):
             self.print_price(price, multiline = True)
 
     def view_prices_for_package(self, level):
         package = self.choose_package(level)
         filter_specs = [{'field': 'package_id', 'match': 'exact', 'value': package['id']}]
-        prices = self.db.get_prices_with_filter(filter_specs)
-        self.print_best_price_summary(prices)
+        self.print_price_summary(level, filter_specs)
+
+    def view_package_trend(self, level):
+        package = self.choose_package(level)
+        product = self.db.get_product_by_id(package['product_id'])
+        self.print_trend(level, self.db.get_unit_price_history(package_id = package['id']), product['unit'])
+
+    def view_product_trend(self, level):
+        product = self.choose_product(level)
+        self.print_trend(level, self.db.get_unit_price_history(product_id = product['id']), product['unit'])
+
+    def print_trend(self, level, history, unit_no):
+        if len(history) == 0:
+            self.cio.print_error(level, "No prices.")
+            return
+        unit_spec = model.normalized_unit_by_no(unit_no)[0]
+        def money(value):
+            return "{0:.2f}/{1}".format(value / 100.0, unit_spec)
+
+        first = datetime.date.fromordinal(history[0][0])
+        last = datetime.date.fromordinal(history[-1][0])
+        self.cio.writeln("%d prices from %s to %s." % (len(history), first, last), level)
+        statistics = trend.rolling(history)
+        for window in trend.WINDOWS:
+            minimum, median = statistics[window][-1]
+            self.cio.writeln("{0:>4}d  min {1:>12}  median {2:>12}".format(window, money(minimum), money(median)), level)
+
+        change = trend.last_change(history)
+        if change == None:
+            self.cio.writeln("Unchanged.", level)
+        else:
+            day, before, after = change
+            ratio = ""
+            if before > 0:
+                ratio = " ({0:+.1f}%)".format((after - before) * 100.0 / before)
+            self.cio.writeln("Last change on %s: %s -> %s%s." % (datetime.date.fromordinal(day), money(before), money(after), ratio), level)
+
+        medians = [median for minimum, median in statistics[trend.WINDOWS[0]]]
+        line = trend.sparkline(medians, self.cio.columns() - 2 * level - 1)
+        if str is bytes:
+            line = line.encode('utf-8')
+        self.cio.writeln(line, level)
+
+    def plan_shopping(self, level):
+        self.cio.print_status(level, "Planning where to shop; one item per line, empty to end.")
+        labels = []
+        items = []
+        while True:
+            pattern = self.cio.read_string(level, "~Product name or id.", null = True)
+            if pattern == None:
+                break
+            if pattern.isdigit():
+                products = list(self.db.get_products_by_ids([int(pattern)]).values())
+            else:
+                products = self.db.get_product_by_name(pattern)
+            if len(products) == 0:
+                self.cio.print_error(level, "No such product.")
+                continue
+            labels.append(pattern if len(products) > 1 else self.format_product(products[0]))
+            items.append([product['id'] for product in products])
+        if len(items) == 0:
+            return
+        count = self.cio.read_integer(level, "~Most stores (2).", null = True)
+        if count == None:
+            count = 2
+
+        rows = self.planner.rows(items)
+        stores = self.db.get_stores_by_ids(self.planner.store_ids)
+        def describe(store_ids, missing, total):
+            s = "{0:.2f}".format(total / 100.0)
+            if missing > 0:
+                s += ", %d missing" % (missing,)
+            return s + ": " + ", ".join([stores[store_id]['name'] for store_id in store_ids])
+
+        self.cio.writeln("Cheapest store per item:", level)
+        for label, (store_id, unit_price) in zip(labels, self.planner.cheapest_per_item(rows)):
+            if store_id == None:
+                self.cio.writeln("  {0:>9}  {1:<16} {2}".format("-", "-", label), level)
+            else:
+                self.cio.writeln("  {0:>9.2f}  {1:<16} {2}".format(unit_price / 100.0, stores[store_id]['name'][0:16], label), level)
+        self.cio.writeln("Single store: " + describe(*self.planner.best_stores(rows, 1)), level)
+        if count > 1:
+            self.cio.writeln("Up to %d stores: " % (count,) + describe(*self.planner.best_stores(rows, count)), level)
 
     def view_prices(self, level):
         self.cio.print_status(level, "Checking prices.")
@@ -481,15 +684,20 @@ class cli:
         options.append({'type': 'string', 'question': "~Product extra.", 'null': True})
         options.append({'type': 'string', 'question': "~Package extra.", 'null': True})
         options.append({'type': 'string', 'question': "~Brand name.",   'null': True})
+        options.append({'type': 'date',   'question': "~Since.",        'null': True})
+        options.append({'type': 'date',   'question': "~Until.",        'null': True})
         fields = ['product_name', 'product_extra', 'package_extra', 'brand_name']
         values = self.read_form(level, options)
         filter_specs = []
         for i in range(len(fields)):
             if values[i] != None:
                 filter_specs.append({'field': fields[i], 'match': 'fuzzy', 'value': values[i]})
+        if values[4] != None:
+            filter_specs.append({'field': 'day', 'match': 'min', 'value': values[4].toordinal()})
+        if values[5] != None:
+            filter_specs.append({'field': 'day', 'match': 'max', 'value': values[5].toordinal()})
 
-        prices = self.db.get_prices_with_filter(filter_specs)
-        self.print_best_price_summary(prices)
+        self.print_price_summary(level, filter_specs)
 
     def delete_last_store(self, level):
         rows = self.db.get_recent_stores(10)
@@ -507,7 +715,7 @@ class cli:
         self.db.delete_product(row['id'])
 
     def delete_last_package(self, level):
-        rows = self.db.get_recent_packages(10)
+        rows = self.prefetch_packages(self.db.get_recent_packages(10))
         row = self.choose(level, rows, self.format_package, False, False)
         self.db.delete_package(row['id'])
 
@@ -556,8 +764,12 @@ class cli:
 
     def view_hidden_packages(self, level):
         self.cio.print_status(level, "Viewing hidden packages.")
-        rows = self.db.get_hidden_packages()
+        rows = self.prefetch_packages(self.db.get_hidden_packages())
         for row in rows:
             self.cio.writeln(self.format_package(row), level)
 
-cli().run()
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        cli().run(sys.argv[1])
+    else:
+        cli().run()
@@ -0,0 +1,162 @@
+import csv
+import datetime
+import json
+import model
+import search
+
+# Bulk import of prices from CSV files (with a header line) or JSON-lines
+# files. Each row has a store name, a date (YYYY-MM-DD or YYYYMMDD), a price
+# and either a barcode or a product spec; the spec is the product name
+# followed by whatever is needed to tell its packages apart: product extra,
+# package extra, brand name and amount with unit (e.g. "arroz tipo 1 5kg").
+# An optional origin ("offline" or "website") overrides the default one.
+
+def read_rows(path):
+    # Yields (line number, row); JSON lines that don't parse come as None.
+    with open(path) as f:
+        if path.endswith('.jsonl') or path.endswith('.json'):
+            for number, line in enumerate(f):
+                line = line.strip()
+                if len(line) > 0:
+                    try:
+                        row = json.loads(line)
+                    except ValueError:
+                        row = None
+                    yield number + 1, row
+        else:
+            reader = csv.DictReader(f)
+            for row in reader:
+                yield reader.line_num, row
+
+# Text fields of JSON-lines rows must be strings; prices and dates may also
+# be numbers.
+
+def text_field(row, name):
+    value = row.get(name)
+    if value == None:
+        return ""
+    if not isinstance(value, model.TEXT_TYPES):
+        raise ValueError("Invalid %s: %r." % (name, value))
+    return value.strip()
+
+def number_field(row, name):
+    value = row.get(name)
+    if value == None or (isinstance(value, model.TEXT_TYPES) and value.strip() == ""):
+        raise ValueError("Missing %s." % (name,))
+    if isinstance(value, bool) or not isinstance(value, model.TEXT_TYPES + model.INTEGER_TYPES + (float,)):
+        raise ValueError("Invalid %s: %r." % (name, value))
+    return value
+
+def parse_date(value):
+    value = str(value).strip().replace('-', '')
+    if len(value) != 8:
+        raise ValueError("Invalid date: %s." % (value,))
+    return datetime.date(int(value[0:4]), int(value[4:6]), int(value[6:8]))
+
+def parse_money(value):
+    if isinstance(value, (int, float)):
+        return int(round(value * 100))
+    return int(round(float(value.strip().replace(',', '.')) * 100))
+
+def format_amount(amount, unit_no):
+    if amount == int(amount):
+        amount = int(amount)
+    return "%s%s" % (amount, model.unit_by_no(unit_no))
+
+def spec_key(words):
+    return " ".join(search.normalize(" ".join([word for word in words if word])).split())
+
+class Importer:
+
+    def __init__(self, db):
+        self.db = db
+        self.stores   = None
+        self.barcodes = None
+        self.specs    = None
+        self.keys     = {}
+
+    def load(self):
+        self.stores = {}
+        for id, name in self.db.cursor.execute('SELECT id, name FROM stores').fetchall():
+            self.stores[spec_key([name])] = id
+
+        # Every package is reachable by its full spec, with and without the
+        # amount, and by the bare product name if it's the only package of
+        # its product. Keys shared by several packages are ambiguous (None).
+        self.barcodes = {}
+        self.specs = {}
+        sql = """SELECT pac.id, pac.barcode, pro.name, pro.extra, pac.extra, bra.name, pac.amount, pro.unit, pro.id
+                 FROM (packages pac JOIN products pro ON pac.product_id = pro.id)
+                                    JOIN brands bra ON pac.brand_id = bra.id"""
+        products = {}
+        for id, barcode, name, product_extra, package_extra, brand_name, amount, unit_no, product_id in self.db.cursor.execute(sql).fetchall():
+            if barcode:
+                self.barcodes[barcode] = id
+            keys = set()
+            keys.add(spec_key([name, product_extra, package_extra, brand_name]))
+            keys.add(spec_key([name, product_extra, package_extra, brand_name, format_amount(amount, unit_no)]))
+            for key in keys:
+                self.add_spec(key, id)
+            products.setdefault(spec_key([name, product_extra]), set()).add(id)
+        for key, ids in products.items():
+            if len(ids) == 1:
+                self.add_spec(key, list(ids)[0])
+
+    def key(self, text):
+        # Imports repeat the same few store names and product specs over and
+        # over, so their keys are computed only once.
+        if text not in self.keys:
+            self.keys[text] = spec_key([text])
+        return self.keys[text]
+
+    def add_spec(self, key, id):
+        if key in self.specs and self.specs[key] != id:
+            self.specs[key] = None
+        else:
+            self.specs[key] = id
+
+    def resolve_package(self, row):
+        barcode = text_field(row, 'barcode')
+        if barcode:
+            if barcode not in self.barcodes:
+                raise ValueError("Unknown barcode: %s." % (barcode,))
+            return self.barcodes[barcode]
+        product = text_field(row, 'product')
+        key = self.key(product)
+        if key not in self.specs:
+            raise ValueError("Unknown product: %s." % (product,))
+        if self.specs[key] == None:
+            raise ValueError("Ambiguous product: %s." % (product,))
+        return self.specs[key]
+
+    def resolve(self, row, origin_no):
+        if row == None:
+            raise ValueError("Invalid JSON.")
+        if not isinstance(row, dict):
+            raise ValueError("Not an object.")
+        store = text_field(row, 'store')
+        if self.key(store) not in self.stores:
+            raise ValueError("Unknown store: %s." % (store,))
+        store_id = self.stores[self.key(store)]
+        package_id = self.resolve_package(row)
+        origin = text_field(row, 'origin')
+        if origin:
+            origin_no = model.origin_by_name(origin)
+            if origin_no == None:
+                raise ValueError("Unknown origin: %s." % (origin,))
+        return (store_id, package_id, parse_money(number_field(row, 'price')), parse_date(number_field(row, 'date')), origin_no)
+
+    def run(self, path, origin_no):
+        # Inserts every row that resolves and returns how many were inserted,
+        # along with (line number, reason) for the ones left out.
+        if self.specs == None:
+            self.load()
+        prices = []
+        unmatched = []
+        for number, row in read_rows(path):
+            try:
+                prices.append(self.resolve(row, origin_no))
+            except (ValueError, KeyError, TypeError, OverflowError) as e:
+                unmatched.append((number, str(e)))
+        self.db.insert_prices(prices)
+        return len(prices), unmatched
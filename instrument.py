@@ -0,0 +1,143 @@
+import re
+import time
+
+# Query accounting for model.Database: Connection and Cursor wrap their
+# sqlite3 counterparts and report every statement to a Profiler, which also
+# times CLI commands so SQL time can be told apart from everything else.
+
+def normalize(sql):
+    return " ".join(sql.split())
+
+PRICES_ALIAS = re.compile(r'\bprices\s+(?:AS\s+)?(\w+)', re.IGNORECASE)
+PLAN_SCAN    = re.compile(r'^SCAN (?:TABLE )?(\w+)')
+
+class Profiler:
+
+    def __init__(self, explain = False):
+        self.explain    = explain
+        self.statements = {}
+        self.commands   = {}
+        self.plans      = {}
+        self.sql_time   = 0.0
+
+    def record(self, sql, rows, seconds):
+        entry = self.statements.setdefault(sql, [0, 0, 0.0])
+        entry[1] += rows
+        entry[2] += seconds
+        self.sql_time += seconds
+
+    def count(self, sql):
+        self.statements.setdefault(sql, [0, 0, 0.0])[0] += 1
+
+    def record_command(self, command, seconds, sql_seconds):
+        entry = self.commands.setdefault(command, [0, 0.0, 0.0])
+        entry[0] += 1
+        entry[1] += seconds
+        entry[2] += sql_seconds
+
+    def hottest_statements(self, count = 15):
+        items = [(entry[2], sql, entry[0], entry[1]) for sql, entry in self.statements.items()]
+        items.sort(reverse = True)
+        return [(sql, calls, rows, seconds) for seconds, sql, calls, rows in items[:count]]
+
+    def explain_query(self, connection, sql, params):
+        # Keeps the plan of statements that scan the whole prices table.
+        key = normalize(sql)
+        if key in self.plans or not self.explain:
+            return
+        self.plans[key] = None
+        if not re.search(r'\bprices\b', key, re.IGNORECASE) or not key.upper().startswith(('SELECT', 'WITH')):
+            return
+        names = set(['prices'] + [alias.lower() for alias in PRICES_ALIAS.findall(sql)])
+        plan = [row[-1] for row in connection.execute('EXPLAIN QUERY PLAN ' + sql, params).fetchall()]
+        for detail in plan:
+            match = PLAN_SCAN.match(detail)
+            if match and match.group(1).lower() in names:
+                self.plans[key] = plan
+                return
+
+    def full_scans(self):
+        return [(sql, plan) for sql, plan in self.plans.items() if plan != None]
+
+class Cursor(object):
+
+    def __init__(self, cursor, connection, profiler):
+        self.cursor     = cursor
+        self.connection = connection
+        self.profiler   = profiler
+        self.sql        = None
+
+    def timed(self, rows, function, *args):
+        start = time.time()
+        result = function(*args)
+        self.profiler.record(self.sql, rows(result), time.time() - start)
+        return result
+
+    def execute(self, sql, params = ()):
+        self.sql = normalize(sql)
+        self.profiler.count(self.sql)
+        self.profiler.explain_query(self.connection, sql, params)
+        self.timed(lambda result: 0, self.cursor.execute, sql, params)
+        return self
+
+    def executemany(self, sql, params):
+        self.sql = normalize(sql)
+        self.profiler.count(self.sql)
+        self.timed(lambda result: 0, self.cursor.executemany, sql, params)
+        return self
+
+    def executescript(self, sql):
+        return self.cursor.executescript(sql)
+
+    def fetchone(self):
+        return self.timed(lambda row: 0 if row == None else 1, self.cursor.fetchone)
+
+    def fetchmany(self, size = None):
+        if size == None:
+            size = self.cursor.arraysize
+        return self.timed(len, self.cursor.fetchmany, size)
+
+    def fetchall(self):
+        return self.timed(len, self.cursor.fetchall)
+
+    def __iter__(self):
+        while True:
+            rows = self.fetchmany(256)
+            if len(rows) == 0:
+                break
+            for row in rows:
+                yield row
+
+    def close(self):
+        self.cursor.close()
+
+    @property
+    def lastrowid(self):
+        return self.cursor.lastrowid
+
+    @property
+    def rowcount(self):
+        return self.cursor.rowcount
+
+class Connection(object):
+
+    def __init__(self, connection, profiler):
+        self.connection = connection
+        self.profiler   = profiler
+
+    def cursor(self):
+        return Cursor(self.connection.cursor(), self.connection, self.profiler)
+
+    def execute(self, sql, params = ()):
+        return self.cursor().execute(sql, params)
+
+    @property
+    def isolation_level(self):
+        return self.connection.isolation_level
+
+    @isolation_level.setter
+    def isolation_level(self, isolation_level):
+        self.connection.isolation_level = isolation_level
+
+    def __getattr__(self, name):
+        return getattr(self.connection, name)
@@ -0,0 +1,123 @@
+import re
+import signal
+import struct
+import unicodedata
+
+# Terminal geometry and text measurement for cio. The terminal is asked
+# for its size once, and again only after SIGWINCH says it has changed.
+# Widths are in display columns: East Asian wide characters take two and
+# combining marks none. Text may be bytes (UTF-8) or unicode; wrap returns
+# lines of the same type it was given.
+
+DEFAULT_DIMENSIONS = (80, 24)
+
+NON_ASCII = re.compile(u"[^\x00-\x7f]")
+
+cached_dimensions = None
+widths = {}
+
+def query_dimensions():
+    # (columns, rows) of the terminal on standard output.
+    try:
+        import fcntl
+        import termios
+        result = fcntl.ioctl(1, termios.TIOCGWINSZ, struct.pack('HHHH', 0, 0, 0, 0))
+    except (ImportError, IOError, OSError):
+        # Not a terminal (e.g. output piped in batch runs).
+        return DEFAULT_DIMENSIONS
+    rows, columns = struct.unpack('HHHH', result)[:2]
+    if rows == 0 or columns == 0:
+        return DEFAULT_DIMENSIONS
+    return columns, rows
+
+def forget_dimensions(signum = None, frame = None):
+    global cached_dimensions
+    cached_dimensions = None
+
+def dimensions():
+    global cached_dimensions
+    if cached_dimensions == None:
+        cached_dimensions = query_dimensions()
+    return cached_dimensions
+
+def watch_resizes():
+    # Signal handlers can only be set from the main thread.
+    try:
+        signal.signal(signal.SIGWINCH, forget_dimensions)
+    except (AttributeError, ValueError):
+        return False
+    return True
+
+def decode(s):
+    if isinstance(s, bytes):
+        return s.decode('utf-8', 'replace')
+    return s
+
+def char_width(c):
+    if c not in widths:
+        if unicodedata.combining(c) or unicodedata.category(c) in ('Mn', 'Me', 'Cf'):
+            widths[c] = 0
+        elif unicodedata.east_asian_width(c) in ('W', 'F'):
+            widths[c] = 2
+        else:
+            widths[c] = 1
+    return widths[c]
+
+def text_width(s):
+    # ASCII characters are one column each; only the others are looked up.
+    others = NON_ASCII.findall(s)
+    if len(others) == 0:
+        return len(s)
+    return len(s) - len(others) + sum([char_width(c) for c in others])
+
+def width(s):
+    return text_width(decode(s))
+
+def split_word(word, limit):
+    # Pieces of a word too wide for a line, each at most limit wide.
+    pieces = []
+    piece = []
+    used = 0
+    for c in word:
+        w = char_width(c)
+        if used + w > limit and len(piece) > 0:
+            pieces.append("".join(piece))
+            piece = []
+            used = 0
+        piece.append(c)
+        used += w
+    pieces.append("".join(piece))
+    return pieces
+
+def wrap(s, limit):
+    # Breaks s at spaces into lines at most limit wide, splitting words
+    # wider than that, in one pass over the words.
+    is_bytes = isinstance(s, bytes)
+    limit = max(1, limit)
+    lines = []
+    line = []
+    used = 0
+    for word in decode(s).split():
+        w = text_width(word)
+        if w > limit:
+            pieces = split_word(word, limit)
+            if len(line) > 0:
+                lines.append(u" ".join(line))
+            lines.extend(pieces[:-1])
+            word = pieces[-1]
+            w = text_width(word)
+            line = []
+            used = 0
+        if len(line) > 0 and used + 1 + w > limit:
+            lines.append(u" ".join(line))
+            line = []
+            used = 0
+        if len(line) > 0:
+            used += 1
+        line.append(word)
+        used += w
+    if len(line) > 0:
+        lines.append(u" ".join(line))
+    if is_bytes:
+        return [line.encode('utf-8') for line in lines]
+    return lines
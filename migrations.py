@@ -0,0 +1,235 @@
+# Forward migrations applied on top of database.sql.
+#
+# The schema version is kept in SQLite's user_version pragma: a database
+# created from database.sql is at version 0, and migration N (counting from 1)
+# brings it to version N. Each migration is a list of steps; a step is either
+# an SQL statement or a function that receives the cursor.
+
+def create_search_index(cursor):
+    try:
+        cursor.execute("CREATE VIRTUAL TABLE search_probe USING fts5(text)")
+        cursor.execute("DROP TABLE search_probe")
+    except Exception:
+        # SQLite was built without FTS5; lookups keep using LIKE.
+        return
+    for sql in SEARCH_INDEX:
+        cursor.execute(sql)
+
+SEARCH_TOKENIZER = "tokenize = 'unicode61 remove_diacritics 2'"
+
+SEARCH_PACKAGE_ROW = """SELECT pac.id, pro.name, pro.extra || ' ' || pac.extra, bra.name
+                        FROM (packages pac JOIN products pro ON pac.product_id = pro.id)
+                                           JOIN brands bra ON pac.brand_id = bra.id"""
+
+SEARCH_INDEX = [
+    "CREATE VIRTUAL TABLE brands_fts USING fts5(name, %s)" % SEARCH_TOKENIZER,
+    "CREATE VIRTUAL TABLE stores_fts USING fts5(name, %s)" % SEARCH_TOKENIZER,
+    "CREATE VIRTUAL TABLE products_fts USING fts5(name, extra, %s)" % SEARCH_TOKENIZER,
+    "CREATE VIRTUAL TABLE packages_fts USING fts5(name, extra, brand, %s)" % SEARCH_TOKENIZER,
+
+    "INSERT INTO brands_fts(rowid, name) SELECT id, name FROM brands",
+    "INSERT INTO stores_fts(rowid, name) SELECT id, name FROM stores",
+    "INSERT INTO products_fts(rowid, name, extra) SELECT id, name, extra FROM products",
+    "INSERT INTO packages_fts(rowid, name, extra, brand) " + SEARCH_PACKAGE_ROW,
+
+    """CREATE TRIGGER brands_fts_insert AFTER INSERT ON brands BEGIN
+         INSERT INTO brands_fts(rowid, name) VALUES(new.id, new.name);
+       END""",
+    """CREATE TRIGGER brands_fts_delete AFTER DELETE ON brands BEGIN
+         DELETE FROM brands_fts WHERE rowid = old.id;
+       END""",
+    """CREATE TRIGGER brands_fts_update AFTER UPDATE OF name ON brands BEGIN
+         UPDATE brands_fts SET name = new.name WHERE rowid = new.id;
+         UPDATE packages_fts SET brand = new.name
+         WHERE rowid IN (SELECT id FROM packages WHERE brand_id = new.id);
+       END""",
+
+    """CREATE TRIGGER stores_fts_insert AFTER INSERT ON stores BEGIN
+         INSERT INTO stores_fts(rowid, name) VALUES(new.id, new.name);
+       END""",
+    """CREATE TRIGGER stores_fts_delete AFTER DELETE ON stores BEGIN
+         DELETE FROM stores_fts WHERE rowid = old.id;
+       END""",
+    """CREATE TRIGGER stores_fts_update AFTER UPDATE OF name ON stores BEGIN
+         UPDATE stores_fts SET name = new.name WHERE rowid = new.id;
+       END""",
+
+    """CREATE TRIGGER products_fts_insert AFTER INSERT ON products BEGIN
+         INSERT INTO products_fts(rowid, name, extra) VALUES(new.id, new.name, new.extra);
+       END""",
+    """CREATE TRIGGER products_fts_delete AFTER DELETE ON products BEGIN
+         DELETE FROM products_fts WHERE rowid = old.id;
+       END""",
+    """CREATE TRIGGER products_fts_update AFTER UPDATE OF name, extra ON products BEGIN
+         UPDATE products_fts SET name = new.name, extra = new.extra WHERE rowid = new.id;
+         DELETE FROM packages_fts WHERE rowid IN (SELECT id FROM packages WHERE product_id = new.id);
+         INSERT INTO packages_fts(rowid, name, extra, brand) """ + SEARCH_PACKAGE_ROW + """
+         WHERE pac.product_id = new.id;
+       END""",
+
+    """CREATE TRIGGER packages_fts_insert AFTER INSERT ON packages BEGIN
+         INSERT INTO packages_fts(rowid, name, extra, brand) """ + SEARCH_PACKAGE_ROW + """
+         WHERE pac.id = new.id;
+       END""",
+    """CREATE TRIGGER packages_fts_delete AFTER DELETE ON packages BEGIN
+         DELETE FROM packages_fts WHERE rowid = old.id;
+       END""",
+    """CREATE TRIGGER packages_fts_update AFTER UPDATE OF product_id, brand_id, extra ON packages BEGIN
+         DELETE FROM packages_fts WHERE rowid = old.id;
+         INSERT INTO packages_fts(rowid, name, extra, brand) """ + SEARCH_PACKAGE_ROW + """
+         WHERE pac.id = new.id;
+       END""",
+]
+
+# Scale from a product's unit to the one its unit price is quoted in:
+# g -> kg, ml -> L and m -> km; the others are kept as they are.
+UNIT_SCALE = "(CASE {0} WHEN 2 THEN 1000.0 WHEN 4 THEN 1000.0 WHEN 6 THEN 1000.0 ELSE 1.0 END)"
+
+UNIT_PRICE = """(SELECT {0} * """ + UNIT_SCALE.format("pro.unit") + """ / pac.amount
+                 FROM packages pac JOIN products pro ON pac.product_id = pro.id
+                 WHERE pac.id = {1})"""
+
+UNIT_PRICE_COLUMN = [
+    "ALTER TABLE prices ADD COLUMN unit_price REAL NULL",
+    "UPDATE prices SET unit_price = " + UNIT_PRICE.format("prices.price", "prices.package_id"),
+    "CREATE INDEX prices_package_id_unit_price ON prices(package_id, unit_price)",
+
+    """CREATE TRIGGER prices_unit_price_insert AFTER INSERT ON prices BEGIN
+         UPDATE prices SET unit_price = """ + UNIT_PRICE.format("new.price", "new.package_id") + """
+         WHERE id = new.id;
+       END""",
+    """CREATE TRIGGER prices_unit_price_update AFTER UPDATE OF price, package_id ON prices BEGIN
+         UPDATE prices SET unit_price = """ + UNIT_PRICE.format("new.price", "new.package_id") + """
+         WHERE id = new.id;
+       END""",
+    """CREATE TRIGGER packages_unit_price_update AFTER UPDATE OF product_id, amount ON packages BEGIN
+         UPDATE prices SET unit_price = """ + UNIT_PRICE.format("prices.price", "new.id") + """
+         WHERE package_id = new.id;
+       END""",
+    """CREATE TRIGGER products_unit_price_update AFTER UPDATE OF unit ON products BEGIN
+         UPDATE prices SET unit_price = """ + UNIT_PRICE.format("prices.price", "prices.package_id") + """
+         WHERE package_id IN (SELECT id FROM packages WHERE product_id = new.id);
+       END""",
+]
+
+# The cheapest and the latest visible price of the package pac; hidden
+# packages, products and brands are left to the queries reading the table.
+BEST_PRICE_ID = """SELECT pri.id FROM prices pri JOIN stores sto ON pri.store_id = sto.id
+                   WHERE pri.package_id = pac.id AND pri.hide = 0 AND sto.hide = 0
+                   ORDER BY pri.unit_price, pri.date DESC, pri.id DESC LIMIT 1"""
+
+LATEST_PRICE_ID = """SELECT pri.id FROM prices pri JOIN stores sto ON pri.store_id = sto.id
+                     WHERE pri.package_id = pac.id AND pri.hide = 0 AND sto.hide = 0
+                     ORDER BY pri.date DESC, pri.id DESC LIMIT 1"""
+
+BEST_PRICES = [
+    """CREATE TABLE best_prices(
+         package_id      INTEGER PRIMARY KEY,
+         product_id      INTEGER NOT NULL,
+         best_price_id   INTEGER NULL,
+         best_unit_price REAL    NULL,
+         latest_price_id INTEGER NULL,
+         latest_date     DATE    NULL
+       )""",
+    "CREATE INDEX best_prices_product_id ON best_prices(product_id)",
+    """INSERT INTO best_prices(package_id, product_id, best_price_id, best_unit_price, latest_price_id, latest_date)
+       SELECT pac.id, pac.product_id, best.id, best.unit_price, latest.id, latest.date
+       FROM (packages pac LEFT JOIN prices best   ON best.id   = (""" + BEST_PRICE_ID + """))
+                          LEFT JOIN prices latest ON latest.id = (""" + LATEST_PRICE_ID + """)""",
+]
+
+# Day number of a date, counting 0001-01-01 as day 1 like date.toordinal().
+DAY_NUMBER = "CAST(julianday({0}) - 1721424.5 AS INTEGER)"
+
+DAY_COLUMN = [
+    "ALTER TABLE prices ADD COLUMN day INTEGER NULL",
+    "UPDATE prices SET day = " + DAY_NUMBER.format("date"),
+    "CREATE INDEX prices_package_id_day ON prices(package_id, day)",
+
+    """CREATE TRIGGER prices_day_insert AFTER INSERT ON prices BEGIN
+         UPDATE prices SET day = """ + DAY_NUMBER.format("new.date") + """ WHERE id = new.id;
+       END""",
+    """CREATE TRIGGER prices_day_update AFTER UPDATE OF date ON prices BEGIN
+         UPDATE prices SET day = """ + DAY_NUMBER.format("new.date") + """ WHERE id = new.id;
+       END""",
+]
+
+# Database fills in unit_price and day itself; the insert triggers are left
+# for rows inserted without them, which saves an UPDATE per row.
+COMPUTED_COLUMNS = [
+    "DROP TRIGGER prices_unit_price_insert",
+    """CREATE TRIGGER prices_unit_price_insert AFTER INSERT ON prices WHEN new.unit_price IS NULL BEGIN
+         UPDATE prices SET unit_price = """ + UNIT_PRICE.format("new.price", "new.package_id") + """
+         WHERE id = new.id;
+       END""",
+    "DROP TRIGGER prices_day_insert",
+    """CREATE TRIGGER prices_day_insert AFTER INSERT ON prices WHEN new.day IS NULL BEGIN
+         UPDATE prices SET day = """ + DAY_NUMBER.format("new.date") + """ WHERE id = new.id;
+       END""",
+]
+
+MIGRATIONS = [
+
+    # 1: Secondary indexes for the price lookups.
+    [
+        "CREATE INDEX IF NOT EXISTS prices_package_id_date ON prices(package_id, date)",
+        "CREATE INDEX IF NOT EXISTS prices_store_id ON prices(store_id)",
+        "CREATE INDEX IF NOT EXISTS packages_product_id ON packages(product_id)",
+        "CREATE INDEX IF NOT EXISTS packages_brand_id ON packages(brand_id)",
+    ],
+
+    # 2: Full-text search index over brands, stores, products and packages.
+    [
+        create_search_index,
+    ],
+
+    # 3: High-water marks of the consistency checks.
+    [
+        """CREATE TABLE checks(
+             name    VARCHAR(32) PRIMARY KEY,
+             last_id INTEGER     NOT NULL
+           )""",
+    ],
+
+    # 4: Price per normalized unit (in cents), kept up to date by triggers.
+    UNIT_PRICE_COLUMN,
+
+    # 5: Cheapest and latest price per package, kept up to date by Database.
+    BEST_PRICES,
+
+    # 6: Dates of prices as day numbers, kept up to date by triggers.
+    DAY_COLUMN,
+
+    # 7: Insert triggers only for prices inserted without unit_price or day.
+    COMPUTED_COLUMNS,
+
+]
+
+def get_version(cursor):
+    return cursor.execute('PRAGMA user_version').fetchone()[0]
+
+def migrate(db, cursor):
+    version = get_version(cursor)
+    if version >= len(MIGRATIONS):
+        return len(MIGRATIONS)
+    # Each migration runs in a transaction of its own together with the
+    # version bump, so an interrupted run leaves the previous version.
+    isolation_level = db.isolation_level
+    db.isolation_level = None
+    try:
+        for i in range(version, len(MIGRATIONS)):
+            cursor.execute('BEGIN IMMEDIATE')
+            try:
+                for step in MIGRATIONS[i]:
+                    if hasattr(step, '__call__'):
+                        step(cursor)
+                    else:
+                        cursor.execute(step)
+                cursor.execute('PRAGMA user_version = %d' % (i + 1))
+            except BaseException:
+                cursor.execute('ROLLBACK')
+                raise
+            cursor.execute('COMMIT')
+    finally:
+        db.isolation_level = isolation_level
+    return len(MIGRATIONS)
@@ -1,5 +1,19 @@
 import _sqlite3 as sqlite3
+import collections
 import datetime, time
+import functools
+import instrument
+import migrations
+import search
+
+# Types of the strings and integers read from JSON, which Python 2 splits
+# in two.
+try:
+    TEXT_TYPES    = (str, unicode)
+    INTEGER_TYPES = (int, long)
+except NameError:
+    TEXT_TYPES    = (str,)
+    INTEGER_TYPES = (int,)
 
 def adapt_date(date):
     return date.isoformat()
@@ -18,6 +32,46 @@ def check_digit(codes):
         s = 0
     return str(s)
 
+def amount_from_extra(s, package_unit):
+    s = s + " "
+    i = 0
+    a = 0
+    nums = []
+    snum = ""
+    sunit = ""
+    while i < len(s):
+        c = s[i]
+        if   a == 0:
+            if   c >= '0' and c <= '9':
+                snum = c
+                sunit = ""
+                a = 1
+        elif a == 1:
+            if   c == " ":
+                nums.append([snum, sunit])
+                a = 2
+            else:
+                if (c >= '0' and c <= '9') or c == '.':
+                    snum += c
+                else:
+                    sunit += c
+        elif a == 2:
+            if   c == " ":
+                a = 0
+        i += 1
+    if len(nums) > 1:
+        value = 1.0
+        for num, unit in nums:
+            if   unit == "u" or unit == package_unit or (unit + "2") == package_unit:
+                value *= float(num)
+            elif unit == "cm" and (package_unit == "m" or package_unit == "m2"):
+                value *= float(num) / 100.0
+            else:
+                raise Exception("Don't know what to do with units: %s and %s." % (unit, package_unit))
+        return value
+    else:
+        return None
+
 def unit_by_name(name):
     try:
         return {"kg": 1, "g": 2, "l": 3, "ml": 4, "u": 5, "m": 6, "m2": 7}[name]
@@ -32,6 +86,42 @@ def unit_by_no(no):
     except:
         return None
 
+def parse_date(s):
+    return datetime.date(int(s[0:4]), int(s[5:7]), int(s[8:10]))
+
+def search_query(pattern):
+    terms = pattern.split()
+    return " ".join(['"%s"*' % term.replace('"', '""') for term in terms])
+
+def normalized_unit_by_no(no):
+    # The unit unit prices are quoted in, and its size in the product's unit.
+    name = unit_by_no(no)
+    if   name == 'g':
+        return 'kg', 1000
+    elif name == 'ml':
+        return 'l', 1000
+    elif name == 'm':
+        return 'km', 1000
+    return name, 1
+
+def summary_key(price):
+    return (price['day'], price['unit_price'], price['id'])
+
+def filter_matches(filter_specs, row):
+    # Whether the row may satisfy the filter; errs on the side of yes.
+    for field, match, value in filter_specs:
+        if field not in row:
+            continue
+        if match == 'fuzzy':
+            if '%' in value or '_' in value:
+                continue
+            # Names are bytes on Python 2 while filter values may be unicode.
+            if search.normalize(value) not in search.normalize(row[field]):
+                return False
+        elif row[field] != value:
+            return False
+    return True
+
 def origin_by_name(name):
     try:
         return {'offline': 1, 'website': 2}[name]
@@ -46,30 +136,233 @@ def origin_by_no(no):
     except:
         return None
 
+class Record(object):
+
+    # Rows are slotted objects rather than dicts, which keeps large listings
+    # small; the mapping methods let them be used as dicts all the same.
+
+    __slots__ = ()
+
+    # Values worked out from the slots, read like them.
+    computed = ()
+
+    def __init__(self, *values):
+        for name, value in zip(self.__slots__, values):
+            setattr(self, name, value)
+
+    def __getitem__(self, key):
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        try:
+            setattr(self, key, value)
+        except AttributeError:
+            raise KeyError(key)
+
+    def __contains__(self, key):
+        return (key in self.__slots__ or key in self.computed) and hasattr(self, key)
+
+    def has_key(self, key):
+        return key in self
+
+    def get(self, key, default = None):
+        return getattr(self, key, default) if key in self else default
+
+    def keys(self):
+        return [key for key in self.__slots__ + self.computed if hasattr(self, key)]
+
+    def items(self):
+        return [(key, getattr(self, key)) for key in self.keys()]
+
+    def __eq__(self, other):
+        return type(self) == type(other) and self.items() == other.items()
+
+    def __ne__(self, other):
+        return not self == other
+
+    # Equal records have the same type and id.
+    def __hash__(self):
+        return hash((type(self).__name__, self.get('id')))
+
+    def copy(self):
+        record = object.__new__(type(self))
+        for key in self.__slots__:
+            if hasattr(self, key):
+                setattr(record, key, getattr(self, key))
+        return record
+
+    def __repr__(self):
+        return "%s(%s)" % (type(self).__name__, ", ".join(["%s=%r" % item for item in self.items()]))
+
+class Brand(Record):
+    __slots__ = ('id', 'hide', 'name')
+
+class Store(Record):
+    __slots__ = ('id', 'hide', 'name')
+
+class Product(Record):
+    __slots__ = ('id', 'hide', 'name', 'extra', 'unit')
+
+class Package(Record):
+    __slots__ = ('id', 'hide', 'product_id', 'brand_id', 'extra', 'amount', 'barcode')
+
+class Price(Record):
+    __slots__ = ('id', 'hide', 'store_id', 'package_id', 'price', 'date', 'origin', 'sic')
+
+class DayRecord(Record):
+    # Prices read by day number, turned into a date only when it's shown.
+    __slots__ = ()
+
+    computed = ('date',)
+
+    @property
+    def date(self):
+        return datetime.date.fromordinal(self.day)
+
+class PackagePrice(DayRecord):
+    __slots__ = ('id', 'hide', 'store_id', 'package_id', 'price', 'day', 'origin', 'sic')
+
+class PriceView(DayRecord):
+    # The last three are only set by get_price_summary.
+    __slots__ = ('product_name', 'product_extra', 'product_unit', 'brand_name',
+                 'package_extra', 'package_amount', 'package_barcode', 'store_name',
+                 'price', 'day', 'id', 'package_id', 'product_id', 'sic', 'unit_price',
+                 'good', 'highlight', 'discarded_count')
+
+def is_busy(error):
+    message = str(error)
+    return 'locked' in message or 'busy' in message
+
+def writes(method):
+    # Marks the Database methods that write. Connections begin transactions
+    # IMMEDIATE, so another writer holding the database makes the first
+    # write of a transaction fail before anything has been changed; the
+    # method is then run again after a growing pause. Nested calls and
+    # calls inside an open transaction run as they are.
+    @functools.wraps(method)
+    def wrapper(self, *args):
+        if self.writing or self.in_transaction:
+            self.writing += 1
+            try:
+                return method(self, *args)
+            finally:
+                self.writing -= 1
+        delay = self.RETRY_DELAY
+        attempt = 0
+        while True:
+            self.writing += 1
+            try:
+                result = method(self, *args)
+            except sqlite3.OperationalError as e:
+                if not is_busy(e) or attempt >= self.retries:
+                    raise
+                self.db.rollback()
+            else:
+                if self.commit_writes:
+                    self.db.commit()
+                else:
+                    self.in_transaction = True
+                return result
+            finally:
+                self.writing -= 1
+            time.sleep(delay)
+            delay = min(delay * 2, self.RETRY_DELAY_MAX)
+            attempt += 1
+    return wrapper
+
 class Database:
 
-    def __init__(self, database_path):
+    JOURNAL_MODES      = ['delete', 'truncate', 'persist', 'memory', 'wal', 'off']
+    SYNCHRONOUS_LEVELS = ['off', 'normal', 'full', 'extra']
+
+    # Pauses between attempts of a write that found the database busy, in
+    # seconds; each attempt also waits up to busy_timeout for the lock.
+    RETRY_DELAY     = 0.01
+    RETRY_DELAY_MAX = 1.0
+
+    def __init__(self, database_path, journal_mode = None, synchronous = None, profiler = None, result_cache_size = 32, read_only = False, busy_timeout = 5.0, retries = 5, commit_writes = False):
         sqlite3.register_adapter(datetime.date, adapt_date)
         self.database_path = database_path
-        self.db = sqlite3.connect(self.database_path)
+        # Read-only connections may be handed from thread to thread by a
+        # pool, which uses each from one thread at a time.
+        self.db = sqlite3.connect(self.database_path, timeout = busy_timeout, isolation_level = 'IMMEDIATE', check_same_thread = not read_only)
         self.db.text_factory = str
+        if profiler != None:
+            self.db = instrument.Connection(self.db, profiler)
         self.cursor = self.db.cursor()
         self.cursor.execute('PRAGMA foreign_keys = ON')
+        if journal_mode != None:
+            if journal_mode.lower() not in self.JOURNAL_MODES:
+                raise Exception("Unknown journal mode: %s." % (journal_mode,))
+            self.cursor.execute('PRAGMA journal_mode = ' + journal_mode.lower())
+        if synchronous != None:
+            if synchronous.lower() not in self.SYNCHRONOUS_LEVELS:
+                raise Exception("Unknown synchronous level: %s." % (synchronous,))
+            self.cursor.execute('PRAGMA synchronous = ' + synchronous.lower())
+        if read_only:
+            # The schema is left to the writer, which migrates it.
+            self.cursor.execute('PRAGMA query_only = ON')
+        else:
+            migrations.migrate(self.db, self.cursor)
+        self.has_search = self.table_exists('packages_fts')
+        self.trigram_indexes = None
+        self.identity_map = {'brands': {}, 'stores': {}, 'products': {}, 'packages': {}}
+        self.results = collections.OrderedDict()
+        self.result_cache_size = result_cache_size
+        self.result_hits = 0
+        self.result_misses = 0
+        self.data_version = None
+        self.last_data_version = None
+        self.retries = retries
+        self.commit_writes = commit_writes
+        self.writing = 0
+        self.in_transaction = False
+        self.read_data_version()
 
     def save(self):
         self.db.commit()
-
-    BRAND_COLUMNS   = ['id', 'hide', 'name']
-    STORE_COLUMNS   = ['id', 'hide', 'name']
-    PRODUCT_COLUMNS = ['id', 'hide', 'name', 'extra', 'unit']
-    PACKAGE_COLUMNS = ['id', 'hide', 'product_id', 'brand_id', 'extra', 'amount', 'barcode']
-    PRICE_COLUMNS   = ['id', 'hide', 'store_id', 'package_id', 'price', 'date', 'origin', 'sic']
-
-    def make_object(self, columns, values):
-        object = {}
-        for i in range(len(columns)):
-            object[columns[i]] = values[i]
-        return object
+        self.in_transaction = False
+
+    def rollback(self):
+        self.db.rollback()
+        self.in_transaction = False
+
+    def read_data_version(self):
+        # Changes when another connection writes. Python 2's sqlite3 commits
+        # before running a PRAGMA, so inside a transaction, when no other
+        # connection can write anyway, the last value read is kept.
+        if not self.in_transaction:
+            self.last_data_version = self.cursor.execute('PRAGMA data_version').fetchone()[0]
+        return self.last_data_version
+
+    def get_data_version(self):
+        # Changes whenever the data does, whether through this connection
+        # or another one.
+        return self.read_data_version(), self.db.total_changes
+
+    def sync(self):
+        # Forgets what is kept in memory if another connection has written
+        # to the database since the last call.
+        version = self.read_data_version()
+        if self.data_version != None and version != self.data_version:
+            self.clear_caches()
+        self.data_version = version
+
+    def clear_caches(self):
+        self.results.clear()
+        for table in self.identity_map:
+            self.identity_map[table].clear()
+        self.trigram_indexes = None
+
+    def table_exists(self, table):
+        rows = self.cursor.execute("SELECT name FROM sqlite_master WHERE name = ?", (table,)).fetchall()
+        return len(rows) > 0
+
+    def make_object(self, record_type, values):
+        return record_type(*values)
 
     def make_column_list(self, columns, prefix = None):
         s = ""
@@ -84,50 +377,176 @@ class Database:
     def placeholders(self, count):
         return ', '.join((['?'] * count))
 
-    def generic_insert(self, table, columns, values):
-        some_columns = columns[:]
+    def generic_insert(self, table, record_type, values):
+        some_columns = list(record_type.__slots__)
         some_columns.remove("id")
         some_columns.remove("hide")
         sql = 'INSERT INTO {0}({1}) VALUES({2})'.format(table, self.make_column_list(some_columns), self.placeholders(len(values)))
         self.cursor.execute(sql, values)
-        return self.make_object(columns, [self.cursor.lastrowid, 0] + list(values))
+        object = self.make_object(record_type, [self.cursor.lastrowid, 0] + list(values))
+        if table in self.identity_map:
+            self.identity_map[table][object['id']] = object
+        return object
 
-    def generic_select(self, table, columns, values = (), suffix = None, first = False):
+    def generic_select(self, table, record_type, values = (), suffix = None, first = False):
         if suffix == None:
             suffix = ""
-        sql = 'SELECT {0} FROM {1} {2}'.format(self.make_column_list(columns), table, suffix)
+        sql = 'SELECT {0} FROM {1} {2}'.format(self.make_column_list(record_type.__slots__), table, suffix)
         rows = self.cursor.execute(sql, values).fetchall()
         if first:
-            return self.make_object(columns, rows[0])
+            return self.make_object(record_type, rows[0])
         else:
-            return [self.make_object(columns, row) for row in rows]
-
-    def generic_get_by_id(self, table, columns, id):
-        return self.generic_select(table, columns, suffix = "WHERE id = ?", values = (id,), first = True)
-
-    def generic_get_recent(self, table, columns, count):
-        return self.generic_select(table, columns, suffix = "ORDER BY id DESC LIMIT ?", values = (count,))
+            return [self.make_object(record_type, row) for row in rows]
 
-    def generic_get_hidden(self, table, columns):
-        return self.generic_select(table, columns, suffix = "WHERE hide = 1")
+    def generic_search(self, table, record_type, pattern, order = None, limit = None):
+        if order == None:
+            order = "{0}_fts.rank".format(table)
+        sql = 'SELECT {0} FROM {1} JOIN {1}_fts ON {1}_fts.rowid = {1}.id WHERE {1}_fts MATCH ? ORDER BY {2}'.format(self.make_column_list(record_type.__slots__, table), table, order)
+        values = (search_query(pattern),)
+        if limit != None:
+            sql += ' LIMIT ?'
+            values += (limit,)
+        rows = self.cursor.execute(sql, values).fetchall()
+        return [self.make_object(record_type, row) for row in rows]
+
+    def generic_get_by_id(self, table, record_type, id):
+        if table not in self.identity_map:
+            return self.generic_select(table, record_type, suffix = "WHERE id = ?", values = (id,), first = True)
+        cache = self.identity_map[table]
+        if id not in cache:
+            cache[id] = self.generic_select(table, record_type, suffix = "WHERE id = ?", values = (id,), first = True)
+        return cache[id]
+
+    BULK_SIZE = 500
+
+    def generic_get_by_ids(self, table, record_type, ids):
+        cache = self.identity_map[table]
+        missing = list(set([id for id in ids if id not in cache]))
+        for i in range(0, len(missing), self.BULK_SIZE):
+            chunk = missing[i:i + self.BULK_SIZE]
+            suffix = "WHERE id IN ({0})".format(self.placeholders(len(chunk)))
+            for object in self.generic_select(table, record_type, suffix = suffix, values = chunk):
+                cache[object['id']] = object
+        return dict([(id, cache[id]) for id in ids if id in cache])
+
+    def cached_result(self, key, compute):
+        # Price lists by (method, filter, arguments), least recently used
+        # first. Callers get copies, so changing them leaves the cache as is.
+        if key in self.results:
+            self.result_hits += 1
+            result = self.results.pop(key)
+        else:
+            self.result_misses += 1
+            result = compute()
+        if self.result_cache_size > 0:
+            self.results[key] = result
+            if len(self.results) > self.result_cache_size:
+                self.results.popitem(last = False)
+        return [row.copy() for row in result]
+
+    def forget_results(self, where, values = ()):
+        # Drops the cached lists that may hold prices of the packages
+        # matching where, whether they were there or should now be.
+        if len(self.results) == 0:
+            return
+        sql = """SELECT pro.name, pro.extra, pac.extra, bra.name, pac.id, pro.id
+                 FROM (packages pac JOIN products pro ON pac.product_id = pro.id)
+                                    JOIN brands bra ON pac.brand_id = bra.id
+                 WHERE %s""" % (where,)
+        fields = ('product_name', 'product_extra', 'package_extra', 'brand_name', 'package_id', 'product_id')
+        rows = [dict(zip(fields, row)) for row in self.cursor.execute(sql, values).fetchall()]
+        for key in list(self.results.keys()):
+            for row in rows:
+                if filter_matches(key[1], row):
+                    del self.results[key]
+                    break
+
+    def forget(self, table, id):
+        if table in self.identity_map:
+            self.identity_map[table].pop(id, None)
+
+    def generic_get_recent(self, table, record_type, count):
+        return self.generic_select(table, record_type, suffix = "ORDER BY id DESC LIMIT ?", values = (count,))
+
+    def generic_get_hidden(self, table, record_type):
+        return self.generic_select(table, record_type, suffix = "WHERE hide = 1")
 
     def generic_delete(self, table, id):
         self.cursor.execute('DELETE FROM ' + table + ' WHERE id = ?', (id,))
+        self.forget(table, id)
 
     def generic_toggle_hide_store(self, table, id):
         self.cursor.execute('UPDATE ' + table + ' SET hide = 1 - hide WHERE id = ?', (id,))
-
+        self.forget(table, id)
+
+    TRIGRAM_SOURCES = {
+        'brands':   "SELECT id, name FROM brands",
+        'stores':   "SELECT id, name FROM stores",
+        'products': "SELECT id, name || ' ' || extra FROM products",
+        'packages': """SELECT pac.id, pro.name || ' ' || pro.extra || ' ' || pac.extra || ' ' || bra.name
+                       FROM (packages pac JOIN products pro ON pac.product_id = pro.id)
+                                          JOIN brands bra ON pac.brand_id = bra.id""",
+    }
+
+    def get_trigram_index(self, table):
+        if self.trigram_indexes == None:
+            self.trigram_indexes = {}
+        if table not in self.trigram_indexes:
+            index = search.TrigramIndex()
+            index.add_all(self.cursor.execute(self.TRIGRAM_SOURCES[table]).fetchall())
+            self.trigram_indexes[table] = index
+        return self.trigram_indexes[table]
+
+    def trigram_add(self, table, id):
+        if self.trigram_indexes == None or table not in self.trigram_indexes:
+            return
+        sql = self.TRIGRAM_SOURCES[table] + " WHERE {0}.id = ?".format('pac' if table == 'packages' else table)
+        for id, text in self.cursor.execute(sql, (id,)).fetchall():
+            self.trigram_indexes[table].add(id, text)
+
+    def trigram_remove(self, table, id):
+        if self.trigram_indexes == None or table not in self.trigram_indexes:
+            return
+        self.trigram_indexes[table].remove(id)
+
+    def generic_fuzzy_search(self, table, record_type, pattern, limit):
+        ids = [id for id, score in self.get_trigram_index(table).search(pattern, limit)]
+        objects = self.generic_get_by_ids(table, record_type, ids)
+        return [objects[id] for id in ids if id in objects]
+
+    def fuzzy_search_brands(self, pattern, limit = 10):
+        return self.generic_fuzzy_search('brands', Brand, pattern, limit)
+
+    def fuzzy_search_stores(self, pattern, limit = 10):
+        return self.generic_fuzzy_search('stores', Store, pattern, limit)
+
+    def fuzzy_search_products(self, pattern, limit = 10):
+        return self.generic_fuzzy_search('products', Product, pattern, limit)
+
+    def fuzzy_search_packages(self, pattern, limit = 10):
+        return self.generic_fuzzy_search('packages', Package, pattern, limit)
+
+    @writes
     def insert_brand(self, name):
-        return self.generic_insert('brands', self.BRAND_COLUMNS, (name,))
+        brand = self.generic_insert('brands', Brand, (name,))
+        self.trigram_add('brands', brand['id'])
+        return brand
 
+    @writes
     def insert_store(self, name):
-        return self.generic_insert('stores', self.STORE_COLUMNS, (name,))
+        store = self.generic_insert('stores', Store, (name,))
+        self.trigram_add('stores', store['id'])
+        return store
 
+    @writes
     def insert_product(self, name, extra, unit_no):
         if extra == None:
             extra = ""
-        return self.generic_insert('products', self.PRODUCT_COLUMNS, (name, extra, unit_no))
+        product = self.generic_insert('products', Product, (name, extra, unit_no))
+        self.trigram_add('products', product['id'])
+        return product
 
+    @writes
     def insert_package(self, product_id, brand_id, extra, amount, barcode):
         if extra == None:
             extra = ""
@@ -135,29 +554,107 @@ class Database:
             brand_id = 0
         if amount == None:
             amount = 1
-        return self.generic_insert('packages', self.PACKAGE_COLUMNS, (product_id, brand_id, extra, amount, barcode))
+        package = self.generic_insert('packages', Package, (product_id, brand_id, extra, amount, barcode))
+        self.trigram_add('packages', package['id'])
+        self.refresh_best_prices("pac.id = ?", (package['id'],))
+        return package
+
+    PRICE_INSERT = 'INSERT INTO prices(store_id, package_id, price, date, origin, sic, unit_price, day) VALUES(?, ?, ?, ?, ?, NULL, ?, ?)'
 
+    @writes
     def insert_price(self, store_id, package_id, price, date, origin_no):
-        return self.generic_insert('prices', self.PRICE_COLUMNS, (store_id, package_id, price, date, origin_no, None))
+        self.cursor.execute(self.PRICE_INSERT, self.price_rows([(store_id, package_id, price, date, origin_no)])[0])
+        price = self.make_object(Price, [self.cursor.lastrowid, 0, store_id, package_id, price, date, origin_no, None])
+        self.refresh_best_prices("pac.id = ?", (package_id,))
+        self.forget_results("pac.id = ?", (package_id,))
+        return price
+
+    def price_rows(self, prices):
+        # The prices with the unit_price and day the triggers of migrations 4
+        # and 6 would give them; unknown packages are left to the foreign key.
+        packages = self.get_packages_by_ids([price[1] for price in prices])
+        products = self.get_products_by_ids([package['product_id'] for package in packages.values()])
+        rows = []
+        for store_id, package_id, price, date, origin_no in prices:
+            unit_price = None
+            package = packages.get(package_id)
+            if package != None and package['product_id'] in products and package['amount']:
+                scale = normalized_unit_by_no(products[package['product_id']]['unit'])[1]
+                unit_price = price * float(scale) / package['amount']
+            rows.append((store_id, package_id, price, date, origin_no, unit_price, date.toordinal()))
+        return rows
+
+    def search_brands(self, pattern, limit = None):
+        if not self.has_search or search_query(pattern) == "":
+            return self.get_brand_by_name(pattern)
+        return self.generic_search('brands', Brand, pattern, limit = limit)
+
+    def search_stores(self, pattern, limit = None):
+        if not self.has_search or search_query(pattern) == "":
+            return self.get_store_by_name(pattern)
+        return self.generic_search('stores', Store, pattern, limit = limit)
+
+    def search_products(self, pattern, limit = None):
+        if not self.has_search or search_query(pattern) == "":
+            return self.get_product_by_name(pattern)
+        return self.generic_search('products', Product, pattern, limit = limit)
+
+    def search_packages(self, pattern, limit = None):
+        if not self.has_search or search_query(pattern) == "":
+            return self.get_package_by_product_name_or_extra(pattern)
+        order = "(SELECT COUNT(*) FROM prices WHERE prices.package_id = packages.id) DESC, packages_fts.rank"
+        return self.generic_search('packages', Package, pattern, order = order, limit = limit)
+
+    @writes
+    def insert_prices(self, prices):
+        # Each price is (store_id, package_id, price, date, origin_no).
+        self.cursor.executemany(self.PRICE_INSERT, self.price_rows(prices))
+        package_ids = list(set([price[1] for price in prices]))
+        for i in range(0, len(package_ids), self.BULK_SIZE):
+            chunk = package_ids[i:i + self.BULK_SIZE]
+            self.refresh_best_prices("pac.id IN ({0})".format(self.placeholders(len(chunk))), chunk)
+            self.forget_results("pac.id IN ({0})".format(self.placeholders(len(chunk))), chunk)
 
     def get_package_by_product_name_or_extra(self, pattern):
-        rows = self.cursor.execute('SELECT ' + self.make_column_list(self.PACKAGE_COLUMNS, 'packages') + ' FROM (packages JOIN products ON packages.product_id = products.id) JOIN prices ON packages.id = prices.package_id WHERE (products.name LIKE ?) OR (products.extra LIKE ?) GROUP BY packages.id ORDER BY COUNT(prices.id) DESC', ('%%%s%%' % pattern, '%%%s%%' % pattern)).fetchall()
-        return [self.make_object(self.PACKAGE_COLUMNS, row) for row in rows]
+        rows = self.cursor.execute('SELECT ' + self.make_column_list(Package.__slots__, 'packages') + ' FROM (packages JOIN products ON packages.product_id = products.id) JOIN prices ON packages.id = prices.package_id WHERE (products.name LIKE ?) OR (products.extra LIKE ?) GROUP BY packages.id ORDER BY COUNT(prices.id) DESC', ('%%%s%%' % pattern, '%%%s%%' % pattern)).fetchall()
+        return [self.make_object(Package, row) for row in rows]
 
     def get_packages_by_product_id(self, product_id):
-        rows = self.cursor.execute('SELECT ' + self.make_column_list(self.PACKAGE_COLUMNS, 'packages') + ' FROM packages JOIN products ON packages.product_id = products.id WHERE products.id = ?', (product_id,)).fetchall()
-        return [self.make_object(self.PACKAGE_COLUMNS, row) for row in rows]
+        rows = self.cursor.execute('SELECT ' + self.make_column_list(Package.__slots__, 'packages') + ' FROM packages JOIN products ON packages.product_id = products.id WHERE products.id = ?', (product_id,)).fetchall()
+        return [self.make_object(Package, row) for row in rows]
 
     def get_prices_by_package(self, package_id):
-        rows = self.cursor.execute('SELECT ' + self.make_column_list(self.PRICE_COLUMNS, 'prices') + ' FROM prices JOIN packages ON prices.package_id = packages.id WHERE prices.package_id = ? ORDER BY date', (package_id,)).fetchall()
-        rows = [self.make_object(self.PRICE_COLUMNS, row) for row in rows]
-        for row in rows:
-            s = row['date']
-            row['date'] = datetime.date(int(s[0:4]), int(s[5:7]), int(s[8:10]))
-        return rows
-
-    def get_prices_with_filter(self, filter_specs = None, order = None, limit = None):
-
+        rows = self.cursor.execute('SELECT ' + self.make_column_list(PackagePrice.__slots__, 'prices') + ' FROM prices JOIN packages ON prices.package_id = packages.id WHERE prices.package_id = ? ORDER BY prices.day', (package_id,)).fetchall()
+        return [self.make_object(PackagePrice, row) for row in rows]
+
+    CHUNK_SIZE = 256
+
+    PRICE_VIEW_SQL = """SELECT pro.name AS product_name,
+                               pro.extra AS product_extra,
+                               pro.unit AS product_unit,
+                               bra.name AS brand_name,
+                               pac.extra AS package_extra,
+                               pac.amount AS package_amount,
+                               pac.barcode AS package_barcode,
+                               sto.name AS store_name,
+                               pri.price AS price,
+                               pri.day AS day,
+                               pri.id AS id,
+                               pac.id AS package_id,
+                               pro.id AS product_id,
+                               pri.sic AS sic,
+                               pri.unit_price AS unit_price
+                        FROM (((prices pri JOIN packages pac ON pri.package_id = pac.id)
+                                           JOIN products pro ON pac.product_id = pro.id)
+                                           JOIN brands bra ON pac.brand_id = bra.id)
+                                           JOIN stores sto ON pri.store_id = sto.id
+                        WHERE %s
+                        AND pri.hide = 0 AND pac.hide = 0 AND pro.hide = 0 AND bra.hide = 0 AND sto.hide = 0
+                        %s
+                        %s
+                     """
+
+    def make_filter(self, filter_specs):
         where  = "1"
         params = []
         if filter_specs != None:
@@ -165,144 +662,323 @@ class Database:
                 if filter_spec['match'] == 'fuzzy':
                     where += " AND " + filter_spec['field'] + " LIKE ?"
                     params.append("%" + filter_spec['value'] + "%")
+                elif filter_spec['match'] == 'min':
+                    where += " AND " + filter_spec['field'] + " >= ?"
+                    params.append(filter_spec['value'])
+                elif filter_spec['match'] == 'max':
+                    where += " AND " + filter_spec['field'] + " <= ?"
+                    params.append(filter_spec['value'])
                 else:
                     where += " AND " + filter_spec['field'] + " = ?"
                     params.append(filter_spec['value'])
+        return where, params
+
+    def filter_key(self, filter_specs):
+        if filter_specs == None:
+            return ()
+        return tuple(sorted([(spec['field'], spec['match'], spec['value']) for spec in filter_specs]))
+
+    def get_prices_with_filter(self, filter_specs = None, order = None, limit = None):
+        key = ('prices', self.filter_key(filter_specs), order, limit)
+        return self.cached_result(key, lambda: list(self.iter_prices_with_filter(filter_specs, order, limit)))
+
+    def iter_prices_with_filter(self, filter_specs = None, order = None, limit = None, reverse = False):
+
+        where, params = self.make_filter(filter_specs)
 
         if order != None:
             if order == "id":
                 order = "ORDER BY id DESC"
+        elif reverse:
+            order = "ORDER BY pri.day DESC, pri.unit_price, pri.id DESC"
         else:
-            order = "ORDER BY pri.date, pri.price / pac.amount DESC"
+            order = "ORDER BY pri.day, pri.unit_price DESC, pri.id"
 
         if limit != None:
             limit = "LIMIT {0}".format(limit)
         else:
             limit = ""
 
-        sql = """SELECT pro.name AS product_name,
-                        pro.extra AS product_extra,
-                        pro.unit AS product_unit,
-                        bra.name AS brand_name,
-                        pac.extra AS package_extra,
-                        pac.amount AS package_amount,
-                        pac.barcode AS package_barcode,
-                        sto.name AS store_name,
-                        pri.price AS price,
-                        pri.date AS date,
-                        pri.id AS id,
-                        pac.id AS package_id,
-                        pro.id AS product_id,
-                        pri.sic AS sic
+        sql = self.PRICE_VIEW_SQL % (where, order, limit)
+
+        # A cursor of its own, so that the caller may run other queries while
+        # consuming the rows.
+        cursor = self.db.cursor()
+        cursor.execute(sql, params)
+        while True:
+            rows = cursor.fetchmany(self.CHUNK_SIZE)
+            if len(rows) == 0:
+                break
+            for row in rows:
+                yield self.make_price_view(row)
+        cursor.close()
+
+    def get_price_summary(self, filter_specs = None, highlight_id = None, after = None, limit = None):
+        key = ('summary', self.filter_key(filter_specs), highlight_id, after, limit)
+        return self.cached_result(key, lambda: self.compute_price_summary(filter_specs, highlight_id, after, limit))
+
+    def compute_price_summary(self, filter_specs, highlight_id, after, limit):
+        # The rows print_price shows for a price history, newest first: every
+        # price cheaper than all newer ones ('good'), the latest price of each
+        # package, and highlight_id. Each row counts the newer rows it stands
+        # for in 'discarded_count'. Pages continue after the summary_key of
+        # the last row of the previous one.
+        where, params = self.make_filter(filter_specs)
+        order = "day DESC, unit_price, id DESC"
+        sql = """WITH filtered AS (%s),
+                      ordered AS (SELECT *,
+                                         MIN(unit_price) OVER (ORDER BY %s ROWS BETWEEN UNBOUNDED PRECEDING AND 1 PRECEDING) AS newer_minimum,
+                                         ROW_NUMBER() OVER (ORDER BY %s) AS position,
+                                         ROW_NUMBER() OVER (PARTITION BY package_id ORDER BY %s) AS package_rank,
+                                         COUNT(*) OVER () AS total
+                                  FROM filtered),
+                      selected AS (SELECT *,
+                                          (newer_minimum IS NULL OR unit_price < newer_minimum) AS good
+                                   FROM ordered
+                                   WHERE newer_minimum IS NULL OR unit_price < newer_minimum OR id = ? OR package_rank = 1),
+                      counted AS (SELECT *,
+                                         LEAD(position, 1, total + 1) OVER (ORDER BY position) - position - 1 AS discarded_count
+                                  FROM selected)
+                 SELECT product_name, product_extra, product_unit, brand_name, package_extra,
+                        package_amount, package_barcode, store_name, price, day, id, package_id,
+                        product_id, sic, unit_price, good, NOT good AND id = ?, discarded_count
+                 FROM counted
+                 WHERE 1 %s
+                 ORDER BY position
+                 %s""" % (self.PRICE_VIEW_SQL % (where, "", ""), order, order, order, "%s", "%s")
+        params = params + [highlight_id, highlight_id]
+
+        keyset = ""
+        if after != None:
+            keyset = "AND (day < ? OR (day = ? AND (unit_price > ? OR (unit_price = ? AND id < ?))))"
+            day, unit_price, id = after
+            params += [day, day, unit_price, unit_price, id]
+        sql = sql % (keyset, "" if limit == None else "LIMIT %d" % (limit,))
+
+        prices = []
+        for row in self.cursor.execute(sql, params).fetchall():
+            price = self.make_price_view(row)
+            if row[15]:
+                price.good = True
+            if row[16]:
+                price.highlight = True
+            price.discarded_count = row[17]
+            prices.append(price)
+        return prices
+
+    def make_price_view(self, row):
+        return PriceView(row[0], row[1], row[2], row[3], row[4], row[5], row[6],
+                         row[7], row[8], row[9], row[10], row[11], row[12], row[13], row[14])
+
+    def get_unit_price_history(self, package_id = None, product_id = None):
+        # [(day, unit_price)] of the visible prices of a package or of every
+        # package of a product, oldest first.
+        if package_id != None:
+            where, value = "pac.id = ?", package_id
+        else:
+            where, value = "pac.product_id = ?", product_id
+        sql = """SELECT pri.day, pri.unit_price
                  FROM (((prices pri JOIN packages pac ON pri.package_id = pac.id)
                                     JOIN products pro ON pac.product_id = pro.id)
                                     JOIN brands bra ON pac.brand_id = bra.id)
                                     JOIN stores sto ON pri.store_id = sto.id
-                 WHERE %s
-                 AND pri.hide = 0 AND pac.hide = 0 AND pro.hide = 0 AND bra.hide = 0 AND sto.hide = 0
-                 %s
-                 %s
-              """ % (where, order, limit)
-        rows = self.cursor.execute(sql, params)
-
-        rows = [{'product_name':    row[0],
-                 'product_extra':   row[1],
-                 'product_unit':    row[2],
-                 'brand_name':      row[3],
-                 'package_extra':   row[4],
-                 'package_amount':  row[5],
-                 'package_barcode': row[6],
-                 'store_name':      row[7],
-                 'price':           row[8],
-                 'date':            row[9],
-                 'id':              row[10],
-                 'package_id':      row[11],
-                 'product_id':      row[12],
-                 'sic':             row[13]}
-                for row in rows]
-        for row in rows:
-            s = row['date']
-            row['date'] = datetime.date(int(s[0:4]), int(s[5:7]), int(s[8:10]))
-        return rows
+                 WHERE %s AND pri.hide = 0 AND pac.hide = 0 AND pro.hide = 0 AND bra.hide = 0 AND sto.hide = 0
+                 AND pri.unit_price IS NOT NULL
+                 ORDER BY pri.day, pri.id""" % (where,)
+        return self.cursor.execute(sql, (value,)).fetchall()
+
+    def get_best_prices_by_product(self, product_id, include_id = None):
+        # The cheapest and the latest price of each package of the product,
+        # as kept in best_prices, plus the price include_id if given.
+        where = """pri.id IN (SELECT best_price_id FROM best_prices WHERE product_id = ?
+                              UNION
+                              SELECT latest_price_id FROM best_prices WHERE product_id = ?
+                              UNION
+                              SELECT ?)"""
+        sql = self.PRICE_VIEW_SQL % (where, "ORDER BY pri.day, pri.unit_price DESC, pri.id", "")
+        rows = self.cursor.execute(sql, (product_id, product_id, include_id)).fetchall()
+        return [self.make_price_view(row) for row in rows]
+
+    def refresh_best_prices(self, where, values = ()):
+        # Recomputes the best_prices rows of the packages matching where.
+        sql = """INSERT OR REPLACE INTO best_prices(package_id, product_id, best_price_id, best_unit_price, latest_price_id, latest_date)
+                 SELECT pac.id, pac.product_id, best.id, best.unit_price, latest.id, latest.date
+                 FROM (packages pac LEFT JOIN prices best   ON best.id   = (%s))
+                                    LEFT JOIN prices latest ON latest.id = (%s)
+                 WHERE %s""" % (migrations.BEST_PRICE_ID, migrations.LATEST_PRICE_ID, where)
+        self.cursor.execute(sql, values)
 
     def get_brand_by_name(self, pattern):
-        return self.generic_select('brands', self.BRAND_COLUMNS, suffix = "WHERE name LIKE ?", values = ("%%%s%%" % pattern,))
+        return self.generic_select('brands', Brand, suffix = "WHERE name LIKE ?", values = ("%%%s%%" % pattern,))
 
     def get_store_by_name(self, pattern):
-        return self.generic_select('stores', self.STORE_COLUMNS, suffix = "WHERE name LIKE ?", values = ("%%%s%%" % pattern,))
+        return self.generic_select('stores', Store, suffix = "WHERE name LIKE ?", values = ("%%%s%%" % pattern,))
 
     def get_product_by_name(self, pattern):
-        return self.generic_select('products', self.PRODUCT_COLUMNS, suffix = "WHERE name LIKE ?", values = ("%%%s%%" % pattern,))
+        return self.generic_select('products', Product, suffix = "WHERE name LIKE ?", values = ("%%%s%%" % pattern,))
 
     def get_package_by_barcode(self, pattern):
-        return self.generic_select('packages', self.PACKAGE_COLUMNS, suffix = "WHERE barcode LIKE ?", values = ('%%%s%%' % pattern,))
+        return self.generic_select('packages', Package, suffix = "WHERE barcode LIKE ?", values = ('%%%s%%' % pattern,))
+
+    def get_package_by_exact_barcode(self, barcode):
+        return self.generic_select('packages', Package, suffix = "WHERE barcode = ?", values = (barcode,))
 
     def get_brand_by_id(self, id):
-        return self.generic_get_by_id('brands', self.BRAND_COLUMNS, id)
+        return self.generic_get_by_id('brands', Brand, id)
 
     def get_store_by_id(self, id):
-        return self.generic_get_by_id('stores', self.STORE_COLUMNS, id)
+        return self.generic_get_by_id('stores', Store, id)
 
     def get_product_by_id(self, id):
-        return self.generic_get_by_id('products', self.PRODUCT_COLUMNS, id)
+        return self.generic_get_by_id('products', Product, id)
 
     def get_package_by_id(self, id):
-        return self.generic_get_by_id('packages', self.PACKAGE_COLUMNS, id)
+        return self.generic_get_by_id('packages', Package, id)
+
+    def get_brands_by_ids(self, ids):
+        return self.generic_get_by_ids('brands', Brand, ids)
+
+    def get_stores_by_ids(self, ids):
+        return self.generic_get_by_ids('stores', Store, ids)
+
+    def get_products_by_ids(self, ids):
+        return self.generic_get_by_ids('products', Product, ids)
+
+    def get_packages_by_ids(self, ids):
+        return self.generic_get_by_ids('packages', Package, ids)
 
     def get_recent_brands(self, count):
-        return self.generic_get_recent('brands', self.BRAND_COLUMNS, count)
+        return self.generic_get_recent('brands', Brand, count)
 
     def get_recent_stores(self, count):
-        return self.generic_get_recent('stores', self.STORE_COLUMNS, count)
+        return self.generic_get_recent('stores', Store, count)
 
     def get_recent_products(self, count):
-        return self.generic_get_recent('products', self.PRODUCT_COLUMNS, count)
+        return self.generic_get_recent('products', Product, count)
 
     def get_recent_packages(self, count):
-        return self.generic_get_recent('packages', self.PACKAGE_COLUMNS, count)
+        return self.generic_get_recent('packages', Package, count)
 
     def get_hidden_brands(self):
-        return self.generic_get_hidden('brands', self.BRAND_COLUMNS)
+        return self.generic_get_hidden('brands', Brand)
 
     def get_hidden_stores(self):
-        return self.generic_get_hidden('stores', self.STORE_COLUMNS)
+        return self.generic_get_hidden('stores', Store)
 
     def get_hidden_products(self):
-        return self.generic_get_hidden('products', self.PRODUCT_COLUMNS)
+        return self.generic_get_hidden('products', Product)
 
     def get_hidden_packages(self):
-        return self.generic_get_hidden('packages', self.PACKAGE_COLUMNS)
+        return self.generic_get_hidden('packages', Package)
 
     def get_all_packages(self):
-        return self.generic_select('packages', self.PACKAGE_COLUMNS)
+        return self.generic_select('packages', Package)
 
     def get_all_prices(self):
-        return self.generic_select('prices', self.PRICE_COLUMNS)
-
+        return self.generic_select('prices', Price)
+
+    def get_last_id(self, table):
+        row = self.cursor.execute('SELECT MAX(id) FROM ' + table).fetchone()
+        return row[0] or 0
+
+    def get_check_mark(self, name):
+        rows = self.cursor.execute('SELECT last_id FROM checks WHERE name = ?', (name,)).fetchall()
+        if len(rows) == 0:
+            return 0
+        return rows[0][0]
+
+    @writes
+    def set_check_mark(self, name, last_id):
+        self.cursor.execute('INSERT OR REPLACE INTO checks(name, last_id) VALUES(?, ?)', (name, last_id))
+
+    @writes
+    def lower_check_mark(self, name, last_id):
+        self.cursor.execute('UPDATE checks SET last_id = MIN(last_id, ?) WHERE name = ?', (last_id, name))
+
+    def get_packages_since(self, since_id = 0):
+        return self.generic_select('packages', Package, suffix = "WHERE id > ?", values = (since_id,))
+
+    def get_packages_with_barcode(self, since_id = 0):
+        return self.generic_select('packages', Package, suffix = "WHERE id > ? AND barcode IS NOT NULL AND barcode != ''", values = (since_id,))
+
+    def get_similar_adjacent_prices(self, since_id = 0):
+        # Pairs of consecutive prices (by id) agreeing on at least four of
+        # origin, store, price, package and date, unless flagged as
+        # intentional by sic. Only prices after since_id are examined, but
+        # the window starts one row earlier so that the first of them still
+        # has its predecessor.
+        sql = """SELECT {0}, {1}
+                 FROM (SELECT id,
+                              sic,
+                              LAG(id) OVER w AS previous_id,
+                              (origin     = LAG(origin)     OVER w) +
+                              (store_id   = LAG(store_id)   OVER w) +
+                              (price      = LAG(price)      OVER w) +
+                              (package_id = LAG(package_id) OVER w) +
+                              (date       = LAG(date)       OVER w) AS same
+                       FROM prices
+                       WHERE id >= (SELECT COALESCE(MAX(id), 0) FROM prices WHERE id <= ?)
+                       WINDOW w AS (ORDER BY id)) adj
+                      JOIN prices previous ON previous.id = adj.previous_id
+                      JOIN prices current  ON current.id  = adj.id
+                 WHERE adj.id > ? AND adj.same > 3 AND adj.sic IS NOT 1
+                 ORDER BY adj.id""".format(self.make_column_list(Price.__slots__, 'previous'), self.make_column_list(Price.__slots__, 'current'))
+        count = len(Price.__slots__)
+        rows = self.cursor.execute(sql, (since_id, since_id)).fetchall()
+        return [(self.make_object(Price, row[:count]), self.make_object(Price, row[count:])) for row in rows]
+
+    @writes
     def delete_price(self, id):
+        self.forget_results("pac.id = (SELECT package_id FROM prices WHERE id = ?)", (id,))
+        rows = self.cursor.execute('SELECT package_id FROM best_prices WHERE best_price_id = ? OR latest_price_id = ?', (id, id)).fetchall()
         self.generic_delete('prices', id)
+        for row in rows:
+            self.refresh_best_prices("pac.id = ?", (row[0],))
+        # The price after this one now has a new predecessor.
+        self.lower_check_mark('prices', id - 1)
+
+    # Packages, products, stores and brands with prices can't be deleted, so
+    # deleting them leaves the cached price lists as they are.
 
+    @writes
     def delete_package(self, id):
         self.generic_delete('packages', id)
+        self.cursor.execute('DELETE FROM best_prices WHERE package_id = ?', (id,))
+        self.trigram_remove('packages', id)
 
+    @writes
     def delete_product(self, id):
         self.generic_delete('products', id)
+        self.trigram_remove('products', id)
 
+    @writes
     def delete_store(self, id):
         self.generic_delete('stores', id)
+        self.trigram_remove('stores', id)
 
+    @writes
     def delete_brand(self, id):
         self.generic_delete('brands', id)
+        self.trigram_remove('brands', id)
 
+    @writes
     def toggle_hide_store(self, id):
         self.generic_toggle_hide_store('stores', id)
+        self.refresh_best_prices("pac.id IN (SELECT DISTINCT package_id FROM prices WHERE store_id = ?)", (id,))
+        self.forget_results("pac.id IN (SELECT DISTINCT package_id FROM prices WHERE store_id = ?)", (id,))
 
+    @writes
     def toggle_hide_brand(self, id):
         self.generic_toggle_hide_store('brands', id)
+        self.forget_results("pac.brand_id = ?", (id,))
 
+    @writes
     def toggle_hide_package(self, id):
         self.generic_toggle_hide_store('packages', id)
+        self.forget_results("pac.id = ?", (id,))
 
+    @writes
     def toggle_hide_product(self, id):
         self.generic_toggle_hide_store('products', id)
+        self.forget_results("pac.product_id = ?", (id,))
 
@@ -0,0 +1,144 @@
+import binascii
+import math
+import unicodedata
+
+def normalize(text):
+    if isinstance(text, bytes):
+        text = text.decode('utf-8', 'replace')
+    text = unicodedata.normalize('NFKD', text)
+    return "".join([c for c in text if not unicodedata.combining(c)]).lower()
+
+def trigrams(text):
+    result = set()
+    for word in normalize(text).split():
+        word = " " + word + " "
+        for i in range(len(word) - 2):
+            result.add(word[i:i + 3])
+    return result
+
+class TrigramIndex:
+
+    # Postings are bitmasks over slots, so that they are intersected and
+    # counted a machine word at a time. Every entry added takes a new slot:
+    # the higher the slot, the more recently the entry was indexed, which
+    # ranks entries that match a pattern equally well.
+
+    def __init__(self):
+        self.slots    = {}
+        self.ids      = []
+        self.grams    = {}
+        self.postings = {}
+        # Slots by the number of trigrams of their entry; of the entries
+        # sharing as many trigrams with a pattern, the shorter are closer.
+        self.sizes    = {}
+
+    def __len__(self):
+        return len(self.slots)
+
+    def add(self, id, text):
+        self.add_all([(id, text)])
+
+    def add_all(self, entries):
+        # Indexes (id, text) pairs, setting the bits of each mask at once.
+        postings = {}
+        sizes = {}
+        for id, text in entries:
+            self.remove(id)
+            grams = trigrams(text)
+            slot = len(self.ids)
+            self.ids.append(id)
+            self.slots[id] = slot
+            self.grams[id] = grams
+            for gram in grams:
+                postings.setdefault(gram, []).append(slot)
+            sizes.setdefault(len(grams), []).append(slot)
+        for masks, slots in [(self.postings, postings), (self.sizes, sizes)]:
+            for key in slots:
+                masks[key] = masks.get(key, 0) | mask_of(slots[key])
+
+    def remove(self, id):
+        slot = self.slots.pop(id, None)
+        if slot == None:
+            return
+        self.ids[slot] = None
+        grams = self.grams.pop(id)
+        mask = ~(1 << slot)
+        for gram in grams:
+            clear(self.postings, gram, mask)
+        clear(self.sizes, len(grams), mask)
+
+    def search(self, pattern, limit = 10, threshold = 0.5):
+        query = trigrams(pattern)
+        if len(query) == 0:
+            return []
+        minimum = int(math.ceil(threshold * len(query)))
+        counter = count_bits([self.postings[gram] for gram in query if gram in self.postings])
+
+        # Entries sharing the most trigrams with the pattern come first, so
+        # levels are only taken from the top until there are enough.
+        levels = []
+        above = 0
+        for count in range(len(query), minimum - 1, -1):
+            mask = at_least(counter, count)
+            levels.append((count, mask & ~above))
+            above = mask
+            if population(above) >= limit:
+                break
+
+        result = []
+        sizes = sorted(self.sizes)
+        for count, mask in levels:
+            for size in sizes:
+                if mask == 0 or len(result) >= limit:
+                    break
+                found = mask & self.sizes[size]
+                mask ^= found
+                while found != 0 and len(result) < limit:
+                    slot = found.bit_length() - 1
+                    found ^= 1 << slot
+                    result.append((self.ids[slot], float(count) / len(query)))
+        return result
+
+def population(mask):
+    return bin(mask).count('1')
+
+if hasattr(int, 'bit_count'):
+    population = int.bit_count
+
+def mask_of(slots):
+    data = bytearray((max(slots) >> 3) + 1)
+    for slot in slots:
+        data[slot >> 3] |= 1 << (slot & 7)
+    data.reverse()
+    return int(binascii.hexlify(data), 16)
+
+def clear(masks, key, mask):
+    masks[key] &= mask
+    if masks[key] == 0:
+        del masks[key]
+
+def count_bits(masks):
+    # Adds up the masks slot by slot; bit k of a slot's sum is in counter[k].
+    counter = []
+    for carry in masks:
+        for k in range(len(counter)):
+            counter[k], carry = counter[k] ^ carry, counter[k] & carry
+            if carry == 0:
+                break
+        if carry != 0:
+            counter.append(carry)
+    return counter
+
+def at_least(counter, count):
+    # The slots whose sum in counter is at least count, from the top bit down.
+    if count >= (1 << len(counter)):
+        return 0
+    greater = 0
+    equal = ~0
+    for k in range(len(counter) - 1, -1, -1):
+        if count & (1 << k):
+            equal &= counter[k]
+        else:
+            greater |= equal & counter[k]
+            equal &= ~counter[k]
+    return greater | equal
@@ -0,0 +1,145 @@
+import argparse
+import json
+import multiprocessing
+import threading
+import debug
+import daemon
+import model
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import urlparse, parse_qsl
+    import queue
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urlparse import urlparse, parse_qsl
+    import Queue as queue
+
+# A local HTTP server for several readers at once. Each request runs in a
+# thread of its own; reads borrow one of a pool of read-only connections
+# and writes are queued for the single writer thread, which owns the only
+# connection allowed to write. The database is put in WAL mode so readers
+# don't wait for the writer.
+#
+#   GET  /search?kind=stores&pattern=super
+#   GET  /prices?package_id=12&order="id"&limit=10
+#   GET  /price_summary?product_name="arroz"&limit=20
+#   POST /add_price   {"store_id": 1, "barcode": "7891234567895", "price": 1099}
+#
+# Query values are read as JSON when they parse as such and as strings
+# otherwise; replies are the daemon's, without the id.
+
+READS  = ['ping', 'search', 'prices', 'price_summary']
+WRITES = ['add_price']
+
+class Pool:
+
+    def __init__(self, database_path, size):
+        self.connections = queue.Queue()
+        for i in range(size):
+            self.connections.put(model.Database(database_path, result_cache_size = debug.RESULT_CACHE_SIZE, read_only = True))
+
+    def call(self, method, params):
+        db = self.connections.get()
+        try:
+            return daemon.Daemon(db).handle_request(method, params)
+        finally:
+            self.connections.put(db)
+
+class Writer(threading.Thread):
+
+    def __init__(self, database_path):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.database_path = database_path
+        self.requests = queue.Queue()
+        self.ready = threading.Event()
+
+    def run(self):
+        db = model.Database(self.database_path, 'wal', debug.SYNCHRONOUS, None, debug.RESULT_CACHE_SIZE,
+                            busy_timeout = debug.BUSY_TIMEOUT, retries = debug.WRITE_RETRIES)
+        handler = daemon.Daemon(db)
+        self.ready.set()
+        while True:
+            method, params, replies = self.requests.get()
+            replies.put(handler.handle_request(method, params))
+
+    def call(self, method, params):
+        replies = queue.Queue()
+        self.requests.put((method, params, replies))
+        return replies.get()
+
+def parse_value(value):
+    try:
+        return json.loads(value)
+    except ValueError:
+        return value
+
+class Handler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        method = url.path.strip('/')
+        if method not in READS:
+            return self.reply(404, {'error': "Unknown method: %s." % (method,)})
+        params = dict([(key, parse_value(value)) for key, value in parse_qsl(url.query)])
+        self.reply(200, self.server.pool.call(method, params))
+
+    def do_POST(self):
+        method = urlparse(self.path).path.strip('/')
+        if method not in WRITES:
+            return self.reply(404, {'error': "Unknown method: %s." % (method,)})
+        length = int(self.headers.get('Content-Length') or 0)
+        try:
+            params = json.loads(self.rfile.read(length).decode('utf-8') or "{}")
+        except ValueError:
+            return self.reply(400, {'error': "Invalid JSON."})
+        self.reply(200, self.server.writer.call(method, params))
+
+    def reply(self, status, body):
+        if 'error' in body and status == 200:
+            status = 400
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        if debug.DEBUG:
+            BaseHTTPRequestHandler.log_message(self, format, *args)
+
+class Server(ThreadingMixIn, HTTPServer):
+
+    daemon_threads = True
+
+    def __init__(self, address, database_path, readers):
+        # The writer comes first, so the schema is migrated (and the
+        # journal in WAL mode) before any reader connects.
+        self.writer = Writer(database_path)
+        self.writer.start()
+        self.writer.ready.wait()
+        self.pool = Pool(database_path, readers)
+        HTTPServer.__init__(self, address, Handler)
+
+def main():
+    parser = argparse.ArgumentParser(description = "Serve price queries over HTTP.")
+    parser.add_argument('--database', default = 'hieroch.db')
+    parser.add_argument('--host', default = '127.0.0.1')
+    parser.add_argument('--port', type = int, default = 8080)
+    parser.add_argument('--readers', type = int, default = multiprocessing.cpu_count())
+    args = parser.parse_args()
+
+    server = Server((args.host, args.port), args.database, args.readers)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,129 @@
+import datetime
+import itertools
+
+# Where to buy a list of items. Each item is a set of product ids (all the
+# products matching a name, say) and costs, at a store, the best recent unit
+# price among them there. Totals are for one normalized unit (kg, l, ...) of
+# every item; items a choice of stores lacks are counted apart, and a choice
+# lacking fewer items always wins.
+
+RECENT_DAYS = 180
+
+# Splits over at most this many store combinations are searched exhaustively;
+# larger ones start from a greedy choice improved by swapping stores.
+EXACT_LIMIT = 5000
+
+INFINITY = float('inf')
+
+MATRIX_SQL = """SELECT pac.product_id, pri.store_id, MIN(pri.unit_price)
+                FROM (((prices pri JOIN packages pac ON pri.package_id = pac.id)
+                                   JOIN products pro ON pac.product_id = pro.id)
+                                   JOIN brands bra ON pac.brand_id = bra.id)
+                                   JOIN stores sto ON pri.store_id = sto.id
+                WHERE pri.day >= ? AND pri.unit_price IS NOT NULL
+                AND pri.hide = 0 AND pac.hide = 0 AND pro.hide = 0 AND bra.hide = 0 AND sto.hide = 0
+                GROUP BY pac.product_id, pri.store_id"""
+
+def combinations_count(n, k):
+    result = 1
+    for i in range(k):
+        result = result * (n - i) // (i + 1)
+    return result
+
+class Planner:
+
+    def __init__(self, db, recent_days = RECENT_DAYS):
+        self.db = db
+        self.recent_days = recent_days
+        self.version = None
+
+    def load(self):
+        # The product x store matrix of best unit prices, as
+        # {product_id: {store_id: unit_price}}, read again only when the
+        # database has changed or the day has.
+        since_day = datetime.date.today().toordinal() - self.recent_days
+        version = (self.db.get_data_version(), since_day)
+        if version == self.version:
+            return
+        self.matrix = {}
+        stores = set()
+        for product_id, store_id, unit_price in self.db.cursor.execute(MATRIX_SQL, (since_day,)).fetchall():
+            self.matrix.setdefault(product_id, {})[store_id] = unit_price
+            stores.add(store_id)
+        self.store_ids = sorted(stores)
+        self.version = version
+
+    def rows(self, items):
+        # One list per item of its price at each store of store_ids.
+        self.load()
+        rows = []
+        for product_ids in items:
+            row = [INFINITY] * len(self.store_ids)
+            for product_id in product_ids:
+                prices = self.matrix.get(product_id, {})
+                for index, store_id in enumerate(self.store_ids):
+                    if prices.get(store_id, INFINITY) < row[index]:
+                        row[index] = prices[store_id]
+            rows.append(row)
+        return rows
+
+    def cost(self, rows, stores):
+        # (missing items, total) of buying every item at the cheapest of
+        # stores (indexes into store_ids).
+        missing = 0
+        total = 0.0
+        for row in rows:
+            value = min([row[index] for index in stores])
+            if value == INFINITY:
+                missing += 1
+            else:
+                total += value
+        return missing, total
+
+    def cheapest_per_item(self, rows):
+        # [(store_id, unit_price)] per item; (None, None) if no store has it.
+        result = []
+        for row in rows:
+            value = min(row) if len(row) > 0 else INFINITY
+            if value == INFINITY:
+                result.append((None, None))
+            else:
+                result.append((self.store_ids[row.index(value)], value))
+        return result
+
+    def best_stores(self, rows, count):
+        # Returns (store_ids, missing, total) for the best choice of at most
+        # count stores.
+        count = min(count, len(self.store_ids))
+        if count < 1:
+            return [], len(rows), 0.0
+        stores = range(len(self.store_ids))
+        if combinations_count(len(stores), count) <= EXACT_LIMIT:
+            best = min(itertools.combinations(stores, count), key = lambda choice: self.cost(rows, choice))
+        else:
+            best = self.improve(rows, self.greedy(rows, count))
+        missing, total = self.cost(rows, best)
+        return [self.store_ids[index] for index in best], missing, total
+
+    def greedy(self, rows, count):
+        chosen = []
+        for i in range(count):
+            candidates = [index for index in range(len(self.store_ids)) if index not in chosen]
+            chosen.append(min(candidates, key = lambda index: self.cost(rows, chosen + [index])))
+        return chosen
+
+    def improve(self, rows, chosen):
+        # Swaps single stores in and out while that lowers the cost.
+        best = self.cost(rows, chosen)
+        improved = True
+        while improved:
+            improved = False
+            for position in range(len(chosen)):
+                for index in range(len(self.store_ids)):
+                    if index in chosen:
+                        continue
+                    choice = chosen[:position] + [index] + chosen[position + 1:]
+                    cost = self.cost(rows, choice)
+                    if cost < best:
+                        chosen, best, improved = choice, cost, True
+        return chosen
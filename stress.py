@@ -0,0 +1,89 @@
+import argparse
+import datetime
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
+import bench
+import model
+
+# Runs several processes inserting prices into one database at the same
+# time, each committing every price (or every --batch prices) as the CLI
+# does, then checks that every price made it and reports the throughput.
+# Each worker tags its prices with a price value of its own range, so the
+# rows of every worker can be counted apart. A price counts as failed when
+# its insert or the commit of its batch fails.
+
+TAG = 1000000
+
+def worker(path, number, count, batch, busy_timeout, retries, start, results):
+    db = model.Database(path, 'wal', None, None, 0, busy_timeout = busy_timeout, retries = retries, commit_writes = batch == 1)
+    store_id, package_id = db.cursor.execute('SELECT store_id, package_id FROM prices LIMIT 1').fetchone()
+    today = datetime.date.today()
+    start.wait()
+    began = time.time()
+    failures = 0
+    # Prices inserted since the last commit; a rollback drops them all.
+    pending = 0
+    for i in range(count + 1):
+        try:
+            if i < count:
+                pending += 1
+                db.insert_price(store_id, package_id, (number + 1) * TAG + i, today, 1)
+            if pending == batch or i == count:
+                db.save()
+                pending = 0
+        except model.sqlite3.OperationalError:
+            failures += pending
+            pending = 0
+            db.rollback()
+    results.put((number, time.time() - began, failures))
+
+def main():
+    parser = argparse.ArgumentParser(description = "Insert prices from several processes at once.")
+    parser.add_argument('--processes', type = int, default = 4)
+    parser.add_argument('--prices', type = int, default = 500, help = "prices per process")
+    parser.add_argument('--batch', type = int, default = 1, help = "prices per commit")
+    parser.add_argument('--busy-timeout', type = float, default = 5.0)
+    parser.add_argument('--retries', type = int, default = 5)
+    parser.add_argument('--database', help = "copy this database instead of generating a small one")
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp(prefix = 'hieroch-stress-')
+    try:
+        path = os.path.join(directory, 'hieroch.db')
+        if args.database != None:
+            shutil.copy(args.database, path)
+        else:
+            bench.generate(path, **bench.SIZES['small'])
+        model.Database(path, 'wal').save()
+
+        start = multiprocessing.Event()
+        results = multiprocessing.Queue()
+        processes = [multiprocessing.Process(target = worker, args = (path, i, args.prices, args.batch, args.busy_timeout, args.retries, start, results))
+                     for i in range(args.processes)]
+        for process in processes:
+            process.start()
+        time.sleep(0.5)
+        began = time.time()
+        start.set()
+        reports = [results.get() for process in processes]
+        elapsed = time.time() - began
+        for process in processes:
+            process.join()
+
+        db = model.Database(path)
+        lost = 0
+        for number, seconds, failures in sorted(reports):
+            stored = db.cursor.execute('SELECT COUNT(*) FROM prices WHERE price >= ? AND price < ?',
+                                       ((number + 1) * TAG, (number + 2) * TAG)).fetchone()[0]
+            lost += args.prices - failures - stored
+            print("process %2d: %6d stored, %4d failed, %7.2fs" % (number, stored, failures, seconds))
+        total = args.processes * args.prices
+        print("%d prices from %d processes in %.2fs: %.0f inserts/s, %d lost." % (total, args.processes, elapsed, total / elapsed, lost))
+    finally:
+        shutil.rmtree(directory)
+
+if __name__ == '__main__':
+    main()
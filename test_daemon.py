@@ -0,0 +1,87 @@
+import io
+import json
+import unittest
+import daemon
+import model
+from test_model import DatabaseTestCase
+
+class Output:
+
+    def __init__(self):
+        self.lines = []
+
+    def write(self, s):
+        self.lines.append(s)
+
+    def flush(self):
+        pass
+
+class DaemonTest(DatabaseTestCase):
+
+    def setUp(self):
+        DatabaseTestCase.setUp(self)
+        self.add_catalog()
+        self.other = self.db.insert_package(self.rice['id'], 0, "", 1, "1234567895")
+        self.db.save()
+        self.daemon = daemon.Daemon(self.db)
+
+    def call(self, method, params):
+        return self.daemon.handle_request(method, params)
+
+    def test_bad_params_are_answered_with_errors(self):
+        self.assertEqual(self.call('search', {'pattern': None}), {'error': "Missing pattern."})
+        self.assertEqual(self.call('search', {'pattern': 12}), {'error': "pattern must be a string."})
+        self.assertEqual(self.call('search', ['arroz']), {'error': "Params must be an object."})
+        self.assertEqual(self.call('search', {'pattern': "arroz", 'limit': "2"}), {'error': "limit must be an integer."})
+        self.assertEqual(self.call('prices', {'package_id': "1"}), {'error': "package_id must be an integer."})
+        self.assertEqual(self.call('price_summary', {'after': "x"}), {'error': "after must be a list of day, unit price and id."})
+        self.assertEqual(self.call('add_price', {'store_id': self.store['id'], 'barcode': "7891234567895", 'price': True}),
+                         {'error': "price must be an integer."})
+        self.assertEqual(self.call('add_price', {'store_id': self.store['id'], 'barcode': "7891234567895", 'price': 100, 'date': "2024"}),
+                         {'error': "Invalid date: 2024."})
+        self.assertEqual(self.call('nap', {}), {'error': "Unknown method: nap."})
+        self.assertEqual(self.call('search', {'pattern': "arroz"})['result'][0]['id'], self.rice_package['id'])
+
+    def test_unexpected_errors_are_answered_too(self):
+        def fail(pattern, limit = None):
+            raise AttributeError("'NoneType' object has no attribute 'split'")
+        self.db.search_packages = fail
+        self.assertEqual(self.call('search', {'pattern': "arroz"}),
+                         {'error': "Internal error: AttributeError: 'NoneType' object has no attribute 'split'"})
+        self.assertEqual(self.call('ping', {}), {'result': "pong"})
+
+    def test_barcodes_must_match_exactly(self):
+        self.assertEqual(self.call('add_price', {'store_id': self.store['id'], 'barcode': "234567895", 'price': 100}),
+                         {'error': "Unknown barcode: 234567895."})
+        price_id = self.call('add_price', {'store_id': self.store['id'], 'barcode': "1234567895", 'price': 100, 'date': "2024-03-01"})['result']
+        prices = self.call('prices', {'package_id': self.other['id']})['result']
+        self.assertEqual([(price['id'], price['date']) for price in prices], [(price_id, "2024-03-01")])
+        self.assertEqual(self.call('prices', {'package_id': self.rice_package['id']}), {'result': []})
+
+    def test_non_ascii_names_leave_cached_filters_alone(self):
+        summary = self.call('price_summary', {'product_name': u"arroz"})['result']
+        product = self.db.insert_product(u"feij\u00e3o", "", model.unit_by_name('kg'))
+        self.db.insert_package(product['id'], 0, "", 1, "7890000000000")
+        self.db.save()
+        self.assertTrue(isinstance(self.call('add_price', {'store_id': self.store['id'], 'barcode': u"7890000000000", 'price': 700})['result'], int))
+        self.assertEqual(self.call('price_summary', {'product_name': u"arroz"})['result'], summary)
+        self.assertEqual(len(self.call('price_summary', {'product_name': u"feij\u00e3o"})['result']), 1)
+
+    def test_stream_goes_on_after_bad_lines(self):
+        lines = ['not json',
+                 '[1]',
+                 '{"id": 1, "method": "search", "params": {"pattern": null}}',
+                 '{"id": 2, "method": "search", "params": 7}',
+                 '',
+                 '{"id": 3, "method": "ping"}']
+        output = Output()
+        self.daemon.serve_stream(io.StringIO(u"\n".join(lines) + u"\n"), output)
+        replies = [json.loads(line) for line in "".join(output.lines).splitlines()]
+        self.assertEqual(replies, [{'id': None, 'error': "Invalid JSON."},
+                                   {'id': None, 'error': "Requests must be objects."},
+                                   {'id': 1, 'error': "Missing pattern."},
+                                   {'id': 2, 'error': "Params must be an object."},
+                                   {'id': 3, 'result': "pong"}])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,61 @@
+import os
+import unittest
+import importer
+import model
+from test_model import DatabaseTestCase
+
+class ImporterTest(DatabaseTestCase):
+
+    def setUp(self):
+        DatabaseTestCase.setUp(self)
+        self.add_catalog()
+        self.db.save()
+
+    def write(self, name, text):
+        path = os.path.join(self.directory, name)
+        with open(path, 'w') as f:
+            f.write(text)
+        return path
+
+    def run_import(self, name, text):
+        return importer.Importer(self.db).run(self.write(name, text), model.origin_by_name('offline'))
+
+    def prices(self):
+        return self.db.cursor.execute('SELECT store_id, package_id, price, date FROM prices ORDER BY id').fetchall()
+
+    def test_imports_csv_and_json_lines(self):
+        count, unmatched = self.run_import('prices.csv', "store,date,price,barcode\nMercado,2024-03-01,\"10,50\",7891234567895\n")
+        self.assertEqual((count, unmatched), (1, []))
+        count, unmatched = self.run_import('prices.jsonl', '{"store": "mercado", "date": 20240302, "price": 11, "product": "arroz 5kg"}\n')
+        self.assertEqual((count, unmatched), (1, []))
+        self.assertEqual(self.prices(), [(self.store['id'], self.rice_package['id'], 1050, '2024-03-01'),
+                                         (self.store['id'], self.rice_package['id'], 1100, '2024-03-02')])
+
+    def test_short_csv_rows_are_reported(self):
+        text = ("store,date,barcode,price\n"
+                "Mercado,2024-03-01,7891234567895\n"
+                "Mercado,2024-03-01\n"
+                "Mercado,2024-03-01,7891234567895,10.50\n")
+        count, unmatched = self.run_import('prices.csv', text)
+        self.assertEqual(count, 1)
+        self.assertEqual(unmatched, [(2, "Missing price."), (3, "Unknown product: .")])
+
+    def test_bad_json_lines_are_reported(self):
+        text = ('{"store": "Mercado", "date": "2024-03-01", "price": null, "barcode": "7891234567895"}\n'
+                '\n'
+                '[1, 2]\n'
+                'not json\n'
+                '{"store": "Mercado", "date": "2024-03-01", "price": "9.99", "barcode": 7891234567895}\n'
+                '{"store": "Mercado", "price": 9.99, "barcode": "7891234567895"}\n'
+                '{"store": "Mercado", "date": "2024-03-01", "price": 9.99, "barcode": "7891234567895"}\n')
+        count, unmatched = self.run_import('prices.jsonl', text)
+        self.assertEqual(count, 1)
+        self.assertEqual(unmatched, [(1, "Missing price."),
+                                     (3, "Not an object."),
+                                     (4, "Invalid JSON."),
+                                     (5, "Invalid barcode: 7891234567895."),
+                                     (6, "Missing date.")])
+        self.assertEqual(self.prices(), [(self.store['id'], self.rice_package['id'], 999, '2024-03-01')])
+
+if __name__ == '__main__':
+    unittest.main()
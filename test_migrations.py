@@ -0,0 +1,83 @@
+import datetime
+import sqlite3
+import unittest
+import migrations
+import model
+from test_model import DatabaseFileTestCase
+
+class MigrationTest(DatabaseFileTestCase):
+
+    def populate(self):
+        # A database as database.sql leaves it, before any migration.
+        connection = sqlite3.connect(self.path)
+        connection.executescript("""
+            INSERT INTO stores(id, name) VALUES(1, 'Mercado');
+            INSERT INTO products(id, name, unit) VALUES(1, 'arroz', 2), (2, 'ovos', 5);
+            INSERT INTO packages(id, product_id, brand_id, amount) VALUES(1, 1, 0, 500), (2, 2, 0, 12);
+            INSERT INTO prices(store_id, package_id, price, date, origin) VALUES(1, 1, 450, '2024-01-31', 1), (1, 2, 1200, '2023-12-01', 1);
+        """)
+        connection.commit()
+        connection.close()
+
+    def columns(self, db, id):
+        return db.cursor.execute('SELECT unit_price, day FROM prices WHERE id = ?', (id,)).fetchone()
+
+    def test_migrates_and_backfills(self):
+        self.populate()
+        db = model.Database(self.path)
+        self.assertEqual(migrations.get_version(db.cursor), len(migrations.MIGRATIONS))
+        self.assertEqual(self.columns(db, 1), (900.0, datetime.date(2024, 1, 31).toordinal()))
+        self.assertEqual(self.columns(db, 2), (100.0, datetime.date(2023, 12, 1).toordinal()))
+        self.assertEqual(db.get_best_prices_by_product(1)[0]['id'], 1)
+        db.db.close()
+
+    def test_migrating_again_changes_nothing(self):
+        model.Database(self.path).db.close()
+        db = model.Database(self.path)
+        self.assertEqual(migrations.migrate(db.db, db.cursor), len(migrations.MIGRATIONS))
+        db.db.close()
+
+    def test_inserted_prices_match_the_triggers(self):
+        self.populate()
+        db = model.Database(self.path)
+        date = datetime.date(2024, 2, 29)
+        first = db.insert_price(1, 1, 333, date, 1)
+        db.insert_prices([(1, 1, 777, date, 1), (1, 2, 1000, date, 1)])
+        # Inserted as older writers do, leaving the columns to the triggers.
+        db.cursor.execute("INSERT INTO prices(store_id, package_id, price, date, origin) VALUES(1, 1, 333, '2024-02-29', 1)")
+        legacy_id = db.cursor.lastrowid
+        self.assertEqual(self.columns(db, first['id']), self.columns(db, legacy_id))
+        rows = db.cursor.execute('SELECT price, unit_price, day FROM prices WHERE id > 2 ORDER BY id').fetchall()
+        self.assertEqual(rows, [(333, 666.0, date.toordinal()),
+                                (777, 1554.0, date.toordinal()),
+                                (1000, 1000 / 12.0, date.toordinal()),
+                                (333, 666.0, date.toordinal())])
+        db.db.close()
+
+    def test_interrupted_migrations_are_undone(self):
+        self.populate()
+        def interrupt(cursor):
+            raise KeyboardInterrupt()
+        steps = migrations.MIGRATIONS[3]
+        migrations.MIGRATIONS[3] = steps[:2] + [interrupt] + steps[2:]
+        try:
+            self.assertRaises(KeyboardInterrupt, model.Database, self.path)
+        finally:
+            migrations.MIGRATIONS[3] = steps
+        connection = sqlite3.connect(self.path)
+        self.assertEqual(migrations.get_version(connection.cursor()), 3)
+        connection.close()
+        db = model.Database(self.path)
+        self.assertEqual(migrations.get_version(db.cursor), len(migrations.MIGRATIONS))
+        self.assertEqual(self.columns(db, 1), (900.0, datetime.date(2024, 1, 31).toordinal()))
+        db.db.close()
+
+    def test_given_columns_are_kept(self):
+        self.populate()
+        db = model.Database(self.path)
+        db.cursor.execute("INSERT INTO prices(store_id, package_id, price, date, origin, unit_price, day) VALUES(1, 1, 100, '2024-02-29', 1, 1.5, 7)")
+        self.assertEqual(self.columns(db, db.cursor.lastrowid), (1.5, 7))
+        db.db.close()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,236 @@
+import datetime
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+import unittest
+import model
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+def create_database(path):
+    connection = sqlite3.connect(path)
+    connection.executescript(open(os.path.join(HERE, 'database.sql')).read())
+    connection.commit()
+    connection.close()
+
+class RecordTest(unittest.TestCase):
+
+    def test_equal_records_hash_alike(self):
+        a = model.Brand(1, 0, "Acme")
+        b = model.Brand(1, 0, "Acme")
+        self.assertEqual(a, b)
+        self.assertEqual(hash(a), hash(b))
+        self.assertEqual(len(set([a, b])), 1)
+
+    def test_records_of_other_types_differ(self):
+        self.assertNotEqual(model.Brand(1, 0, "Acme"), model.Store(1, 0, "Acme"))
+        self.assertEqual(len(set([model.Brand(1, 0, "Acme"), model.Store(1, 0, "Acme")])), 2)
+
+    def test_price_view_dates_read_like_slots(self):
+        price = model.PriceView(*range(15))
+        price['day'] = datetime.date(2024, 2, 29).toordinal()
+        self.assertIn('date', price)
+        self.assertEqual(price.get('date'), datetime.date(2024, 2, 29))
+        self.assertEqual(dict(price.items())['date'], datetime.date(2024, 2, 29))
+        self.assertRaises(KeyError, price.__setitem__, 'date', None)
+        self.assertEqual(price.copy(), price)
+
+class DatabaseFileTestCase(unittest.TestCase):
+
+    # A database as database.sql leaves it, in a directory of its own.
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix = 'hieroch-test-')
+        self.path = os.path.join(self.directory, 'hieroch.db')
+        create_database(self.path)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+class DatabaseTestCase(DatabaseFileTestCase):
+
+    def setUp(self):
+        DatabaseFileTestCase.setUp(self)
+        self.db = model.Database(self.path)
+
+    def tearDown(self):
+        self.db.db.close()
+        DatabaseFileTestCase.tearDown(self)
+
+    def add_catalog(self):
+        self.store = self.db.insert_store("Mercado")
+        self.rice = self.db.insert_product("arroz", "", model.unit_by_name('kg'))
+        self.rice_package = self.db.insert_package(self.rice['id'], 0, "", 5, "7891234567895")
+
+    def add_prices(self):
+        self.add_catalog()
+        self.beans = self.db.insert_product("feijao", "", model.unit_by_name('kg'))
+        self.beans_package = self.db.insert_package(self.beans['id'], 0, "", 1, None)
+        day = datetime.date(2024, 1, 1)
+        for i, price in enumerate([1000, 900, 950, 800, 850, 990]):
+            self.db.insert_price(self.store['id'], self.rice_package['id'], price, day + datetime.timedelta(i), 1)
+            self.db.insert_price(self.store['id'], self.beans_package['id'], price // 2, day + datetime.timedelta(i), 1)
+        self.db.save()
+
+class DatabaseTest(DatabaseTestCase):
+
+    def test_records_from_the_database_are_hashable(self):
+        brand = self.db.insert_brand("Acme")
+        self.assertIn(self.db.get_brand_by_id(brand['id']), set([brand]))
+
+    def test_prices_by_package_come_oldest_first(self):
+        self.add_prices()
+        prices = self.db.get_prices_by_package(self.rice_package['id'])
+        self.assertEqual([price['date'] for price in prices], [datetime.date(2024, 1, 1 + i) for i in range(6)])
+        self.assertEqual(prices[0]['day'], datetime.date(2024, 1, 1).toordinal())
+
+    def test_unit_price_history_leaves_hidden_records_out(self):
+        self.add_prices()
+        brand = self.db.insert_brand("Acme")
+        package = self.db.insert_package(self.rice['id'], brand['id'], "", 1, None)
+        self.db.insert_price(self.store['id'], package['id'], 100, datetime.date(2024, 2, 1), 1)
+        self.assertEqual(len(self.db.get_unit_price_history(product_id = self.rice['id'])), 7)
+        self.db.toggle_hide_brand(brand['id'])
+        self.assertEqual(len(self.db.get_unit_price_history(product_id = self.rice['id'])), 6)
+        self.db.toggle_hide_package(self.rice_package['id'])
+        self.assertEqual(self.db.get_unit_price_history(package_id = self.rice_package['id']), [])
+        self.db.toggle_hide_product(self.beans['id'])
+        self.assertEqual(self.db.get_unit_price_history(product_id = self.beans['id']), [])
+
+class ResultCacheTest(DatabaseTestCase):
+
+    def setUp(self):
+        DatabaseTestCase.setUp(self)
+        self.add_prices()
+        self.rice_filter = [{'field': 'product_name', 'match': 'fuzzy', 'value': "arroz"}]
+        self.beans_filter = [{'field': 'product_id', 'match': 'exact', 'value': self.beans['id']}]
+
+    def test_hits_return_what_a_fresh_query_would(self):
+        first = self.db.get_price_summary(self.rice_filter)
+        second = self.db.get_price_summary(self.rice_filter)
+        self.assertEqual((self.db.result_hits, self.db.result_misses), (1, 1))
+        self.assertEqual(first, second)
+        self.assertEqual(second, self.db.compute_price_summary(self.rice_filter, None, None, None))
+
+    def test_callers_get_copies(self):
+        prices = self.db.get_prices_with_filter(self.rice_filter)
+        prices[0]['price'] = 1
+        prices[0]['highlight'] = True
+        prices.pop()
+        again = self.db.get_prices_with_filter(self.rice_filter)
+        self.assertEqual(len(again), 6)
+        self.assertEqual(again[0]['price'], 1000)
+        self.assertNotIn('highlight', again[0])
+
+    def test_writes_forget_the_lists_they_change(self):
+        self.db.get_prices_with_filter(self.rice_filter)
+        self.db.get_prices_with_filter(self.beans_filter)
+        self.db.insert_price(self.store['id'], self.rice_package['id'], 500, datetime.date(2024, 2, 1), 1)
+        self.assertEqual(len(self.db.get_prices_with_filter(self.rice_filter)), 7)
+        self.assertEqual(len(self.db.get_prices_with_filter(self.beans_filter)), 6)
+        self.assertEqual((self.db.result_hits, self.db.result_misses), (1, 3))
+
+        self.db.toggle_hide_package(self.beans_package['id'])
+        self.assertEqual(self.db.get_prices_with_filter(self.beans_filter), [])
+        self.db.delete_price(self.db.get_prices_with_filter(self.rice_filter, "id", 1)[0]['id'])
+        self.assertEqual(len(self.db.get_prices_with_filter(self.rice_filter)), 6)
+
+    def test_least_recently_used_lists_go_first(self):
+        self.db.result_cache_size = 2
+        self.db.get_prices_with_filter(self.rice_filter)
+        self.db.get_prices_with_filter(self.beans_filter)
+        self.db.get_prices_with_filter(self.rice_filter)
+        self.db.get_price_summary(self.rice_filter)
+        self.assertEqual([key[0] for key in self.db.results], ['prices', 'summary'])
+        self.assertEqual(list(self.db.results)[0][1], self.db.filter_key(self.rice_filter))
+
+    def test_other_connections_writes_are_noticed(self):
+        self.db.sync()
+        self.db.get_prices_with_filter(self.rice_filter)
+        other = model.Database(self.path)
+        other.insert_price(self.store['id'], self.rice_package['id'], 500, datetime.date(2024, 2, 1), 1)
+        other.save()
+        other.db.close()
+        self.db.sync()
+        self.assertEqual(len(self.db.get_prices_with_filter(self.rice_filter)), 7)
+
+class PriceSummaryTest(DatabaseTestCase):
+
+    def setUp(self):
+        DatabaseTestCase.setUp(self)
+        self.add_prices()
+
+    def test_pages_add_up_to_the_whole_summary(self):
+        whole = self.db.get_price_summary()
+        self.assertTrue(len(whole) > 3)
+        for size in [1, 2, 3]:
+            pages = []
+            after = None
+            while True:
+                page = self.db.get_price_summary(None, None, after, size)
+                pages += page
+                if len(page) < size:
+                    break
+                after = model.summary_key(page[-1])
+            self.assertEqual(pages, whole)
+
+    def test_summary_keeps_prices_cheaper_than_newer_ones(self):
+        filter_specs = [{'field': 'package_id', 'match': 'exact', 'value': self.rice_package['id']}]
+        prices = self.db.get_price_summary(filter_specs)
+        self.assertEqual([(price['price'], price['discarded_count']) for price in prices], [(990, 0), (850, 0), (800, 3)])
+        highlight_id = self.db.get_prices_with_filter(filter_specs)[0]['id']
+        prices = self.db.get_price_summary(filter_specs, highlight_id)
+        self.assertEqual([(price['price'], price['discarded_count'], 'highlight' in price) for price in prices],
+                         [(990, 0, False), (850, 0, False), (800, 2, False), (1000, 0, True)])
+
+class WritesTest(DatabaseTestCase):
+
+    def lock(self, seconds):
+        # Holds the write lock from another connection for a while.
+        connection = sqlite3.connect(self.path, check_same_thread = False)
+        connection.execute('BEGIN IMMEDIATE')
+        timer = threading.Timer(seconds, connection.commit)
+        timer.start()
+        return timer
+
+    def test_busy_writes_are_retried(self):
+        db = model.Database(self.path, busy_timeout = 0.01, retries = 20)
+        timer = self.lock(0.2)
+        start = time.time()
+        brand = db.insert_brand("Acme")
+        self.assertTrue(time.time() - start >= 0.15)
+        timer.join()
+        db.save()
+        self.assertEqual(self.db.get_brand_by_id(brand['id'])['name'], "Acme")
+        db.db.close()
+
+    def test_writes_give_up_after_the_retries(self):
+        db = model.Database(self.path, busy_timeout = 0.01, retries = 1)
+        timer = self.lock(1.0)
+        self.assertRaises(sqlite3.OperationalError, db.insert_brand, "Acme")
+        self.assertEqual((db.writing, db.in_transaction), (0, False))
+        timer.join()
+        db.db.close()
+        self.assertEqual(self.db.get_brand_by_name("Acme"), [])
+
+    def test_writes_commit_at_once_unless_batched(self):
+        db = model.Database(self.path, commit_writes = True)
+        db.insert_brand("Acme")
+        self.assertFalse(db.in_transaction)
+        db.rollback()
+        self.assertEqual(len(self.db.get_brand_by_name("Acme")), 1)
+        db.db.close()
+
+    def test_sync_leaves_batches_open(self):
+        self.db.insert_brand("Acme")
+        self.assertTrue(self.db.in_transaction)
+        self.db.sync()
+        self.db.get_data_version()
+        self.db.rollback()
+        self.assertEqual(self.db.get_brand_by_name("Acme"), [])
+
+if __name__ == '__main__':
+    unittest.main()
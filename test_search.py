@@ -0,0 +1,29 @@
+import unittest
+import search
+
+class TrigramIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.index = search.TrigramIndex()
+        self.index.add_all([(1, "arroz 5kg"), (2, "arroz integral"), (3, "feijao preto"), (4, "arroz")])
+
+    def ids(self, pattern, limit = 10):
+        return [id for id, score in self.index.search(pattern, limit)]
+
+    def test_mistyped_patterns_rank_closest_first(self):
+        self.assertEqual(self.ids("aroz"), [4, 1, 2])
+        self.assertEqual(self.ids("aroz integal"), [2])
+        self.assertEqual(self.ids(u"feij\u00e3o"), [3])
+        self.assertEqual(self.index.search("arroz", 1), [(4, 1.0)])
+        self.assertEqual(self.ids("xyz"), [])
+
+    def test_updates_replace_entries(self):
+        self.index.add(4, "feijao carioca")
+        self.index.remove(1)
+        self.index.remove(5)
+        self.assertEqual(len(self.index), 3)
+        self.assertEqual(self.ids("aroz"), [2])
+        self.assertEqual(self.ids("feijao"), [3, 4])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+import bisect
+import collections
+
+# Trends of a price history: a list of (day, unit_price) sorted by day, as
+# returned by Database.get_unit_price_history. Every statistic is taken in
+# one pass over the history, with the window ending at each observation.
+
+WINDOWS = [30, 90, 365]
+
+BARS = u"▁▂▃▄▅▆▇█"
+
+def rolling(history, windows = WINDOWS):
+    # Returns {window: [(minimum, median)]}, one pair per observation, over
+    # the observations of the last window days up to and including it.
+    # Each window keeps the deque of candidates for its minimum (values
+    # increasing from oldest to newest) and the sorted values for its median.
+    result = {}
+    states = []
+    for window in windows:
+        result[window] = []
+        states.append((window, result[window], collections.deque(), [], [0]))
+    for i, (day, value) in enumerate(history):
+        for window, output, minimums, values, start in states:
+            while history[start[0]][0] <= day - window:
+                old = history[start[0]][1]
+                if minimums[0][0] == start[0]:
+                    minimums.popleft()
+                del values[bisect.bisect_left(values, old)]
+                start[0] += 1
+            while len(minimums) > 0 and minimums[-1][1] >= value:
+                minimums.pop()
+            minimums.append((i, value))
+            bisect.insort(values, value)
+            count = len(values)
+            if count % 2 == 1:
+                median = values[count // 2]
+            else:
+                median = (values[count // 2 - 1] + values[count // 2]) / 2.0
+            output.append((minimums[0][1], median))
+    return result
+
+def last_change(history):
+    # The last observation that differs from the one before it, as
+    # (day, previous value, value), or None if the price never changed.
+    for i in range(len(history) - 1, 0, -1):
+        if history[i][1] != history[i - 1][1]:
+            return history[i][0], history[i - 1][1], history[i][1]
+    return None
+
+def sparkline(values, width):
+    # One bar per group of consecutive values, showing the group's last one.
+    if len(values) == 0 or width < 1:
+        return u""
+    if len(values) > width:
+        values = [values[(i + 1) * len(values) // width - 1] for i in range(width)]
+    low = min(values)
+    high = max(values)
+    if high == low:
+        return BARS[0] * len(values)
+    scale = (len(BARS) - 1) / float(high - low)
+    return u"".join([BARS[int(round((value - low) * scale))] for value in values])